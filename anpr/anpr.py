@@ -5,11 +5,15 @@ import datetime
 import http.client
 import json
 import argparse
+import os
+import sys
 import urllib.parse
 import urllib.request
 
 from xml.etree import cElementTree as ET
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
 _FORNITORE_SCONOSCIUTO = 'Fornitore non pervenuto'
 
 
@@ -447,16 +451,14 @@ def PrintState(collections):
 
 def SaveToMongo(collections):
     import pymongo
+    from common import StagedPublish
 
     client = pymongo.MongoClient()
     db = client.get_database('monitor_mdb')
 
-    for collection, data in collections.iteritems():
-        temp_collection = '_temp_%s' % collection
-        for row in data:
-            db[temp_collection].insert_one(row)
-        # if temp_collection in db.collection_names():
-        db[temp_collection].rename(collection, dropTarget=True)
+    with StagedPublish(db) as publish:
+        for collection, data in collections.iteritems():
+            publish.load(collection, data)
 
 
 def GetParseOptions():
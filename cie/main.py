@@ -9,7 +9,7 @@ import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from common import MongoAction
+from common import MongoAction, dataFrameToDocuments, seriesToDocument
 
 # CIE EMESSE PER REGIONE: sum (Totale CIE Emesse)
 # POPOLAZIONE TOTALE: sum (Popolazione)
@@ -44,18 +44,20 @@ str_column = {
 
 
 class CIE:
-    def save_to_mongo(self, args, collection, collection_temp, data, method):
+    def to_documents(self, data, method):
+        if method:
+            return dataFrameToDocuments(data)
+        return [seriesToDocument(data)]
+
+    def save_to_mongo(self, args, collections):
         mongoAction = MongoAction(args.mongodb_user, args.mongodb_pass, args.mongodb_db, args.mongodb_host, args.mongodb_authdb)
         mongoAction.createClient()
 
-        if method:
-            data_json = [row.to_dict() for idx, row in data.iterrows()]
-            mongoAction.insertManyCollection(collection_temp, data_json)
-        else:
-            data_json = data.to_dict()
-            mongoAction.insertCollection(collection_temp, data_json)
+        # All the collections go live together once every load is done
+        with mongoAction.stagedPublish() as publish:
+            for collection, (data, method, indexes) in collections.items():
+                publish.load(collection, self.to_documents(data, method), indexes)
 
-        mongoAction.renameCollection(collection_temp, collection)
         mongoAction.closeClient()
 
     def download_stats(self, url):
@@ -118,12 +120,14 @@ class CIE:
         nazione["%NonCIE"] = (100-nazione["%CIE"])
 
         # MONGO
-        # insert data CIE
-        self.save_to_mongo(args, "cie_comuni", "cie_tmp", cie, True)
-        # insert data REGIONE
-        self.save_to_mongo(args, "cie_regioni", "cie_regione_tmp", final, True)
-        # insert data NAZIONE (1 record)
-        self.save_to_mongo(args, "cie_italia", "cie_italia_tmp", nazione, False)
+        self.save_to_mongo(args, {
+            # insert data CIE
+            "cie_comuni": (cie, True, ["Codice ISTAT", "Regione"]),
+            # insert data REGIONE
+            "cie_regioni": (final, True, []),
+            # insert data NAZIONE (1 record)
+            "cie_italia": (nazione, False, []),
+        })
 
 
 def GetParseOptions():
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+from pymongo import InsertOne
+
+
+class BulkWriter:
+    """
+    Buffers documents and writes them to a collection in unordered batches.
+
+    Usage:
+        with mongoAction.bulkWriter('collection_tmp') as writer:
+            for doc in docs:
+                writer.insert(doc)
+
+    Pending documents are flushed when the buffer reaches batchSize and when
+    the context exits without errors.
+    """
+
+    DEFAULT_BATCH_SIZE = 1000
+
+    collection = None
+    batchSize = None
+    ordered = False
+    inserted = 0
+
+    def __init__(self, collection, batchSize=DEFAULT_BATCH_SIZE, ordered=False):
+        self.collection = collection
+        self.batchSize = max(1, int(batchSize))
+        self.ordered = ordered
+        self.inserted = 0
+        self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._buffer = []
+        return False
+
+    def insert(self, doc):
+        self._buffer.append(InsertOne(doc))
+        if len(self._buffer) >= self.batchSize:
+            self.flush()
+
+    def insertMany(self, docs):
+        for doc in docs:
+            self.insert(doc)
+
+    def flush(self):
+        if not self._buffer:
+            return
+
+        requests, self._buffer = self._buffer, []
+        result = self.collection.bulk_write(requests, ordered=self.ordered)
+        self.inserted += result.inserted_count
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import ast
+import csv
+import gzip
+import itertools
+import re
+from datetime import datetime
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+ATTEMPT_FNS = [ast.literal_eval,
+    int,
+    float,
+    lambda x: datetime.strptime(x, TIMESTAMP_FORMAT)]
+
+_INTEGER = re.compile(r'\s*[+-]?\d+(_\d+)*\s*\Z')
+_LITERAL_START = '+-.([{\'"'
+_LITERAL_NAMES = {'true', 'false', 'none', 'nan', 'inf', 'infinity'}
+
+
+def guessType(value):
+    """
+    Converts a CSV value trying, in order, a python literal, an int, a float
+    and a timestamp. The value is returned unchanged if nothing fits.
+    """
+    for fn in ATTEMPT_FNS:
+        try:
+            return fn(value)
+        except (ValueError, SyntaxError):
+            pass
+    return value
+
+
+def _couldConvert(value):
+    # Cheap check telling whether guessType() could turn the value into
+    # something other than the string itself.
+    first = value[0]
+    if first.isdigit() or first.isspace() or first in _LITERAL_START:
+        return True
+    if first in 'bBrRuU' and ('"' in value[:3] or "'" in value[:3]):
+        return True
+    return value.lower() in _LITERAL_NAMES
+
+
+def _number(value):
+    if _INTEGER.match(value):
+        return int(value)
+    return float(value)
+
+
+def _timestamp(value):
+    # Same result as strptime(TIMESTAMP_FORMAT), without parsing the format
+    if len(value) == 20 and value[4] == '-' and value[7] == '-' and value[10] == 'T' and value[19] == 'Z':
+        return datetime.fromisoformat(value[:19])
+    raise ValueError(value)
+
+
+def _text(value):
+    if value and _couldConvert(value):
+        return guessType(value)
+    return value
+
+
+def _withFallback(fn):
+    def convert(value):
+        if not value:
+            return value
+        try:
+            return fn(value)
+        except ValueError:
+            return guessType(value)
+    return convert
+
+
+CONVERTERS = {
+    'number': _withFallback(_number),
+    'timestamp': _withFallback(_timestamp),
+    'text': _text,
+    'literal': guessType,
+}
+
+
+def _kindOf(value):
+    if isinstance(value, bool):
+        return 'literal'
+    if isinstance(value, (int, float)):
+        return 'number'
+    if isinstance(value, datetime):
+        return 'timestamp'
+    if isinstance(value, str):
+        return 'text'
+    return 'literal'
+
+
+class CsvLoader:
+    """
+    Iterates over the rows of a CSV file (gzip-compressed if its name ends
+    with .gz) as typed documents.
+
+    The type of each column is inferred once from the first sampleSize rows
+    and turned into a converter; the full guessType() chain only runs for
+    the cells that don't fit their column's converter.
+    """
+
+    SAMPLE_SIZE = 100
+
+    filename = None
+    sampleSize = None
+    delimiter = None
+    quotechar = None
+
+    def __init__(self, filename, sampleSize=SAMPLE_SIZE, delimiter=',', quotechar='"'):
+        self.filename = filename
+        self.sampleSize = sampleSize
+        self.delimiter = delimiter
+        self.quotechar = quotechar
+
+    @staticmethod
+    def compileConverters(fieldnames, sample):
+        converters = {}
+        for field in fieldnames:
+            kinds = {_kindOf(guessType(row[field])) for row in sample if row.get(field)}
+            if not kinds:
+                # Only empty cells in the sample
+                kind = 'text'
+            elif len(kinds) == 1:
+                kind = kinds.pop()
+            else:
+                kind = 'literal'
+            converters[field] = CONVERTERS[kind]
+        return converters
+
+    def __iter__(self):
+        opener = gzip.open if self.filename.endswith('.gz') else open
+        with opener(self.filename, "rt") as csvfile:
+            datareader = csv.DictReader(csvfile, delimiter=self.delimiter, quotechar=self.quotechar)
+            sample = list(itertools.islice(datareader, self.sampleSize))
+            converters = self.compileConverters(datareader.fieldnames or [], sample)
+
+            for row in itertools.chain(sample, datareader):
+                yield {field: converters[field](value) if field in converters else value
+                    for field, value in row.items()}
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import math
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def toPythonValue(value):
+    """
+    Converts a single pandas/numpy value to something BSON can encode:
+    numpy scalars become python scalars, Timestamps become datetimes and
+    NaN/NaT/NA become None.
+    """
+    if value is None or value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def columnValues(series):
+    """
+    Converts a whole column at once to a list of BSON-friendly python values.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        if getattr(series.dtype, 'tz', None) is not None:
+            series = series.dt.tz_convert(None)
+        # numpy turns datetime64[us] into datetime objects, and NaT into None
+        return series.to_numpy(dtype='datetime64[us]').astype(object).tolist()
+
+    values = series.to_numpy(dtype=object)
+    missing = series.isna().to_numpy()
+    if missing.any():
+        values[missing] = None
+
+    if series.dtype == object:
+        return [toPythonValue(v) for v in values]
+    return values.tolist()
+
+
+def dataFrameToDocuments(data, chunkSize=DEFAULT_CHUNK_SIZE):
+    """
+    Yields the rows of a DataFrame as documents.
+
+    Columns are converted one chunk of rows at a time, so only chunkSize
+    documents are alive at once and no per-row Series is ever built.
+    """
+    keys = [str(c) for c in data.columns]
+
+    for start in range(0, len(data), chunkSize):
+        chunk = data.iloc[start:start + chunkSize]
+        columns = [columnValues(chunk.iloc[:, i]) for i in range(len(keys))]
+        for row in zip(*columns):
+            yield dict(zip(keys, row))
+
+
+def seriesToDocument(data):
+    """
+    Converts a Series (e.g. an aggregate row) to a single document.
+    """
+    return {str(k): toPythonValue(v) for k, v in data.items()}
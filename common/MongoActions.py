@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
-from pymongo import MongoClient
+from .BulkWriter import BulkWriter
+from .MongoClientPool import MongoClientPool
+from .StagedPublish import StagedPublish
 
 class MongoAction:
 
@@ -10,22 +12,29 @@ class MongoAction:
     password = None
     client = None
     authdb = None
+    clientOptions = None
 
-    def __init__(self, username, password, db, host, authdb):
+    def __init__(self, username, password, db, host, authdb, **clientOptions):
         self.username = username
         self.password = password
         self.db = db
         self.host = host
         self.authdb = authdb
+        # maxPoolSize, minPoolSize, connectTimeoutMS, serverSelectionTimeoutMS,
+        # socketTimeoutMS, compressors (see MongoClientPool)
+        self.clientOptions = clientOptions
 
     def createClient(self):
-        self.client = MongoClient(host=self.host,
-            username=self.username,
-            password=self.password,
-            authSource=self.authdb)
+        self.client = MongoClientPool.getClient(self.host,
+            self.username,
+            self.password,
+            self.authdb,
+            **self.clientOptions)
 
     def closeClient(self):
-        self.client.close()
+        # The client is shared through MongoClientPool and closed at exit,
+        # so here we only release our reference to it.
+        self.client = None
 
     def saveObject(self, collectionName, obj):
         self.client[self.db][collectionName].insert_one(obj)
@@ -33,8 +42,15 @@ class MongoAction:
     def insertCollection(self, collection, obj):
         self.client[self.db][collection].insert_one(obj)
 
-    def insertManyCollection(self, collection, obj):
-        self.client[self.db][collection].insert_many(obj)
+    def insertManyCollection(self, collection, obj, batchSize=BulkWriter.DEFAULT_BATCH_SIZE):
+        with self.bulkWriter(collection, batchSize) as writer:
+            writer.insertMany(obj)
+
+    def bulkWriter(self, collection, batchSize=BulkWriter.DEFAULT_BATCH_SIZE):
+        return BulkWriter(self.client[self.db][collection], batchSize)
+
+    def stagedPublish(self, workers=StagedPublish.DEFAULT_WORKERS, batchSize=BulkWriter.DEFAULT_BATCH_SIZE, atomic=True):
+        return StagedPublish(self.client[self.db], workers, batchSize, atomic)
 
     def dropAndInsertCollection(self, collection, obj):
         self.client[self.db][collection].drop()
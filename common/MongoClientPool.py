@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import atexit
+import os
+import threading
+
+from pymongo import MongoClient
+
+# Environment variables used as defaults for the client options, so that
+# the connection pool can be tuned from .env without touching the scripts.
+ENV_OPTIONS = {
+    'maxPoolSize': ('MONGODB_MAX_POOL_SIZE', int),
+    'minPoolSize': ('MONGODB_MIN_POOL_SIZE', int),
+    'connectTimeoutMS': ('MONGODB_CONNECT_TIMEOUT_MS', int),
+    'serverSelectionTimeoutMS': ('MONGODB_SERVER_SELECTION_TIMEOUT_MS', int),
+    'socketTimeoutMS': ('MONGODB_SOCKET_TIMEOUT_MS', int),
+    'compressors': ('MONGODB_COMPRESSORS', str),
+}
+
+
+class MongoClientPool:
+    """
+    Process-wide registry of MongoClient instances keyed by host, user and
+    auth DB.
+
+    Every MongoAction pointing to the same server shares one client, and so
+    one warm connection pool, instead of paying the TCP/TLS/SCRAM handshake
+    for each new client. Options are only applied when the client is first
+    created; all the clients are closed when the process exits.
+    """
+
+    _clients = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def defaultOptions():
+        options = {}
+        for option, (variable, cast) in ENV_OPTIONS.items():
+            value = os.getenv(variable)
+            if value:
+                options[option] = cast(value)
+        return options
+
+    @classmethod
+    def getClient(cls, host, username, password, authdb, **options):
+        key = (host, username, authdb)
+
+        with cls._lock:
+            client = cls._clients.get(key)
+            if client is None:
+                clientOptions = cls.defaultOptions()
+                clientOptions.update({k: v for k, v in options.items() if v is not None})
+
+                client = MongoClient(host=host,
+                    username=username,
+                    password=password,
+                    authSource=authdb,
+                    **clientOptions)
+                cls._clients[key] = client
+
+        return client
+
+    @classmethod
+    def closeAll(cls):
+        with cls._lock:
+            for client in cls._clients.values():
+                client.close()
+            cls._clients = {}
+
+
+atexit.register(MongoClientPool.closeAll)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+
+from .BulkWriter import BulkWriter
+
+
+class StagedPublish:
+    """
+    Loads several collections into temporary '<name>_tmp' collections from a
+    thread pool and swaps them over the live ones once every load is done.
+
+    Usage:
+        with mongoAction.stagedPublish() as publish:
+            publish.load('cie_comuni', docs, indexes=['Codice ISTAT'])
+            publish.load('cie_italia', [doc])
+
+    docs can be any iterable of documents; generators are consumed in the
+    worker thread, so building the documents runs concurrently too. Indexes
+    are created on the temporary collection before the swap. If any load
+    fails nothing is renamed, the temporary collections are dropped and an
+    exception is raised.
+
+    A source without documents fails its load and the live collection is
+    kept, unless load() is given allowEmpty=True: the live collection is
+    then replaced with an empty one.
+
+    With atomic=False every collection is swapped on its own: a failed load
+    only drops its temporary collection and the others still go live.
+    After publishing, results maps each collection to the number of
+    documents loaded or to the exception that made it fail.
+    """
+
+    TEMP_SUFFIX = '_tmp'
+    DEFAULT_WORKERS = 4
+
+    database = None
+    batchSize = None
+    atomic = True
+    results = None
+
+    def __init__(self, database, workers=DEFAULT_WORKERS, batchSize=BulkWriter.DEFAULT_BATCH_SIZE, atomic=True):
+        self.database = database
+        self.batchSize = batchSize
+        self.atomic = atomic
+        self.results = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(workers)))
+        self._loads = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.publish()
+        else:
+            self._abort()
+        return False
+
+    def tempName(self, collection):
+        return collection + self.TEMP_SUFFIX
+
+    def load(self, collection, docs, indexes=None, allowEmpty=False):
+        if collection in self._loads:
+            raise Exception('Collection {} is already staged.'.format(collection))
+
+        self._loads[collection] = self._executor.submit(
+            self._load, self.tempName(collection), docs, indexes or [], allowEmpty)
+
+    def _load(self, temp, docs, indexes, allowEmpty):
+        # Leftovers of a previous failed run would end up in the live collection
+        self.database[temp].drop()
+
+        with BulkWriter(self.database[temp], self.batchSize) as writer:
+            writer.insertMany(docs)
+
+        if writer.inserted == 0:
+            # An empty source is more likely a broken one than no data at all
+            if not allowEmpty:
+                raise Exception('No documents to load into {}.'.format(temp))
+
+            # Renaming a collection that was never written to fails
+            self.database.create_collection(temp)
+
+        for index in indexes:
+            self.database[temp].create_index(index)
+
+        return writer.inserted
+
+    def publish(self):
+        self._executor.shutdown(wait=True)
+
+        errors = {}
+        for collection, future in self._loads.items():
+            error = future.exception()
+            if error is not None:
+                errors[collection] = error
+            self.results[collection] = error if error is not None else future.result()
+
+        if errors and self.atomic:
+            self._dropTemps()
+            raise Exception('Could not load {}'.format(
+                '; '.join('{} ({})'.format(c, e) for c, e in sorted(errors.items()))))
+
+        for collection in self._loads:
+            temp = self.tempName(collection)
+            if collection in errors:
+                self.database[temp].drop()
+                continue
+
+            try:
+                self.database[temp].rename(collection, dropTarget=True)
+            except Exception as e:
+                if self.atomic:
+                    raise
+                self.results[collection] = e
+
+    def _abort(self):
+        for future in self._loads.values():
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        self._dropTemps()
+
+    def _dropTemps(self):
+        for collection in self._loads:
+            self.database[self.tempName(collection)].drop()
@@ -1,5 +1,11 @@
 #!/usr/bin/env python
 
 from .MongoActions import MongoAction
+from .BulkWriter import BulkWriter
+from .MongoClientPool import MongoClientPool
+from .StagedPublish import StagedPublish
+from .CsvLoader import CsvLoader
+from .DataFrameDocuments import dataFrameToDocuments, seriesToDocument
 
-__all__ = ['MongoAction']
+__all__ = ['MongoAction', 'BulkWriter', 'MongoClientPool', 'StagedPublish', 'CsvLoader',
+           'dataFrameToDocuments', 'seriesToDocument']
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""
+Microbenchmark of Engine.strip_date over every input shape produced by the
+engines, compared with the plain strptime/strftime implementation.
+
+    python bench_strip_date.py [-n NUMBER]
+"""
+
+import argparse
+import random
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from engines.engine import Engine
+
+
+def reference_strip_date(in_timestamp):
+    if isinstance(in_timestamp, str):
+        if len(in_timestamp) <= 10:
+            timestamp = datetime.strptime(in_timestamp, '%Y-%m-%d')
+        else:
+            try:
+                timestamp = datetime.strptime(in_timestamp, '%Y-%m-%dT%H:%M:%SZ')
+            except ValueError:
+                timestamp = datetime.strptime(in_timestamp, '%Y-%m-%dT%H:%M:%S.%fZ')
+    else:
+        timestamp = in_timestamp
+
+    timestamp = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def samples(size):
+    """Random inputs spread over a few years of history, for each shape."""
+    start = datetime(2017, 1, 1)
+    moments = [start + timedelta(seconds=random.randrange(6 * 365 * 24 * 3600)) for _ in range(size)]
+
+    return {
+        # catalogue releaseDate
+        'YYYY-MM-DD': [m.strftime('%Y-%m-%d') for m in moments],
+        # GitHub created_at and commit dates
+        'YYYY-MM-DDTHH:MM:SSZ': [m.strftime('%Y-%m-%dT%H:%M:%SZ') for m in moments],
+        # Discourse created_at, last_seen_at and onboarding timestamps
+        'YYYY-MM-DDTHH:MM:SS.fffZ': [m.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z' for m in moments],
+        # Slack and Google Analytics
+        'datetime': moments,
+        # Newsletter
+        'aware datetime': [m.replace(tzinfo=timezone.utc) for m in moments],
+    }
+
+
+# Strings both implementations must reject
+MALFORMED = [
+    '2020-01-01T99:99:99Z',
+    '2020-01-01Tab:cd:efZ',
+    '2020-01-01T24:00:00Z',
+    '2020-01-01T12:60:00Z',
+    '2020-01-01T12:00:60Z',
+    '2020-01-01T12:00:00.Z',
+    '2020-01-01T12:00:00.1234567Z',
+    '2020-01-01T12:00:00',
+    '2020-01-01 12:00:00Z',
+    '2020-13-01T00:00:00Z',
+    '2020-02-30T00:00:00Z',
+    '2020-02-30',
+    '2020-0a-01',
+    '2020-01-01Z',
+]
+
+
+def outcome(fn, value):
+    try:
+        return fn(value)
+    except ValueError:
+        return ValueError
+
+
+class _Args(object):
+    num_threads = 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Engine.strip_date")
+    parser.add_argument('-n', action="store", dest="number", type=int, default=100000, help="Inputs per shape")
+    args = parser.parse_args()
+
+    engine = Engine(_Args(), 'bench')
+
+    for v in MALFORMED:
+        if outcome(engine.strip_date, v) is not ValueError or outcome(reference_strip_date, v) is not ValueError:
+            raise Exception('{!r} should be rejected: {!r}'.format(v, outcome(engine.strip_date, v)))
+
+    print('{:<26}{:>12}{:>12}{:>9}'.format('shape', 'reference', 'strip_date', 'speedup'))
+    for shape, values in samples(args.number).items():
+        for v in values:
+            if outcome(engine.strip_date, v) != outcome(reference_strip_date, v):
+                raise Exception('Mismatch for {!r}: {} != {}'.format(v, outcome(engine.strip_date, v), outcome(reference_strip_date, v)))
+
+        reference = timeit.timeit(lambda: [reference_strip_date(v) for v in values], number=1)
+        current = timeit.timeit(lambda: [engine.strip_date(v) for v in values], number=1)
+        print('{:<26}{:>11.3f}s{:>11.3f}s{:>8.1f}x'.format(shape, reference, current, reference / current))
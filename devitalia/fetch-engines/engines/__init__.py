@@ -22,10 +22,12 @@ from .catalogo_stats import Catalogo
 from .catalogoregioni_stats import CatalogoRegioni
 from .catalogocategories_stats import CatalogoCategories
 from .catalogoaudiences_stats import CatalogoAudiences
+from .catalogue import SoftwareCatalogue
 
 __all__ = [
     'Engine',
     'GitHub', 'Slack', 'Forum', 'GAnalytics',
     'Onboarding',
-    'Catalogo', 'CatalogoRegioni', 'CatalogoCategories', 'CatalogoAudiences'
+    'Catalogo', 'CatalogoRegioni', 'CatalogoCategories', 'CatalogoAudiences',
+    'SoftwareCatalogue'
 ]
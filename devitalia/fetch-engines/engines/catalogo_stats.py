@@ -1,11 +1,9 @@
 #!/usr/bin/env python3
 
-import requests
-import yaml
-
 from statistics import mean
 from datetime import datetime
-from .engine import Engine
+from .engine import Engine, DistinctCounter
+from .catalogue import SoftwareCatalogue, codice_ipa
 
 class Catalogo(Engine):
     """
@@ -28,123 +26,92 @@ class Catalogo(Engine):
     - https://crawler.developers.italia.it/software_tags.yml
     '''
 
-    SOFTWARES_URL = 'https://crawler.developers.italia.it/softwares.yml'
     INDICEPA_URL = 'https://www.indicepa.gov.it/public-services/opendata-read-service.php?dstype=FS&filename=amministrazioni.txt'
 
     softwares = None
     administrations = None
+    pas = None
+    pas_reusing = None
+    vitalities = None
 
     def __init__(self, args):
         super(Catalogo, self).__init__(args, 'catalogo')
-        #each metric must have a corresponding method
+        #each metric must have a corresponding visitor
         self.metric_names = ['num_pas', 'num_softwares', 'num_softwares_reuse', 'num_softwares_reusing', 'vitality', 'num_pas_reusing']
+        self.record_sources = {'software_records': self.metric_names}
 
     def _get_softwares(self):
-        sws = requests.get(self.SOFTWARES_URL).content
-        sws = yaml.safe_load(sws)
-        self.softwares = sws
-
-    # Total number of PAs
-    def num_pas(self):
-        self.logger.info('Getting num repos...')
+        self.softwares = SoftwareCatalogue.get(self)
+
+    def software_records(self):
+        """
+        Yields every software with its release date. Records are
+        (software, codiceIPA) pairs, codiceIPA being None for the softwares
+        not released for reuse.
+        """
         if self.softwares is None:
             self._get_softwares()
 
-        totpa = []
-        listpa = {}
         for sw in self.softwares:
             # FIXME: non è la data corretta, da prendere da repolist
-            timestamp = self.strip_date(sw['publiccode']['releaseDate']) 
-            if timestamp not in listpa:
-                listpa[timestamp] = []
+            yield self.strip_date(sw['publiccode']['releaseDate']), (sw, codice_ipa(sw))
 
-            if 'it' in sw['publiccode'] and 'riuso' in sw['publiccode']['it'] and 'codiceIPA' in sw['publiccode']['it']['riuso']:
-                newpa = sw['publiccode']['it']['riuso']['codiceIPA'].lower()
-                if newpa not in listpa[timestamp] and newpa not in totpa:
-                    listpa[timestamp].append(newpa)
-                    totpa.append(newpa)
+    # Total number of PAs
+    def start_num_pas(self):
+        self.pas = DistinctCounter()
 
-        for ts, lst_pas in listpa.items():
-            self.add_timestamp_to_metrics(ts)
-            self.metrics[ts]['num_pas'] = len(lst_pas)
+    def visit_num_pas(self, timestamp, record):
+        sw, ipa = record
+        if ipa is not None:
+            self.pas.add(ipa.lower(), timestamp)
 
-    # Total number of softwares
-    def num_softwares(self):
-        self.logger.info('Getting num softwares...')
-        if self.softwares is None:
-            self._get_softwares()
+    def finish_num_pas(self):
+        for ts, num in self.pas.counts().items():
+            self.metrics[ts]['num_pas'] = num
 
-        for sw in self.softwares:
-            timestamp = self.strip_date(sw['publiccode']['releaseDate'])
-            self.add_timestamp_to_metrics(timestamp)
-            self.metrics[timestamp]['num_softwares'] += 1
+    # Total number of softwares
+    def visit_num_softwares(self, timestamp, record):
+        self.metrics[timestamp]['num_softwares'] += 1
 
     # Total number of softwares released for reuse
-    def num_softwares_reuse(self):
-        self.logger.info('Getting num softwares reuse...')
-        if self.softwares is None:
-            self._get_softwares()
-
-        for sw in self.softwares:
-            timestamp = self.strip_date(sw['publiccode']['releaseDate'])
-            self.add_timestamp_to_metrics(timestamp)
-            if 'it' in sw['publiccode'] and 'riuso' in sw['publiccode']['it'] and 'codiceIPA' in sw['publiccode']['it']['riuso']:
-                self.metrics[timestamp]['num_softwares_reuse'] += 1
+    def visit_num_softwares_reuse(self, timestamp, record):
+        sw, ipa = record
+        if ipa is not None:
+            self.metrics[timestamp]['num_softwares_reuse'] += 1
 
     # Total number of softwares reused at least once
-    def num_softwares_reusing(self):
-        self.logger.info('Getting num softwares reusing...')
-        if self.softwares is None:
-            self._get_softwares()
-
-        for sw in self.softwares:
-            timestamp = self.strip_date(sw['publiccode']['releaseDate'])
-            self.add_timestamp_to_metrics(timestamp)
-            if 'usedBy' in sw['publiccode'] and sw['publiccode']['usedBy']:
-                self.metrics[timestamp]['num_softwares_reusing'] += 1
+    def visit_num_softwares_reusing(self, timestamp, record):
+        sw, ipa = record
+        if 'usedBy' in sw['publiccode'] and sw['publiccode']['usedBy']:
+            self.metrics[timestamp]['num_softwares_reusing'] += 1
 
     # Total software vitality
-    def vitality(self):
-        self.logger.info('Getting software vitality...')
-        if self.softwares is None:
-            self._get_softwares()
+    def start_vitality(self):
+        self.vitalities = {}
 
-        vitality = {}
-        for sw in self.softwares:
-            timestamp = self.strip_date(sw['publiccode']['releaseDate'])
-            if timestamp not in vitality:
-                vitality[timestamp] = { 'num': 0, 'val': 0 }
-    
-            vitality[timestamp]['num'] += 1
-            if sw['vitalityDataChart'] is None:
-                vitality[timestamp]['val'] += 0
-            else:
-                vitality[timestamp]['val'] += mean(sw['vitalityDataChart'])
-
-        for ts, vit in vitality.items():
-            self.add_timestamp_to_metrics(ts)
+    def visit_vitality(self, timestamp, record):
+        sw, ipa = record
+        if timestamp not in self.vitalities:
+            self.vitalities[timestamp] = { 'num': 0, 'val': 0 }
+
+        self.vitalities[timestamp]['num'] += 1
+        if sw['vitalityDataChart'] is not None:
+            self.vitalities[timestamp]['val'] += mean(sw['vitalityDataChart'])
+
+    def finish_vitality(self):
+        for ts, vit in self.vitalities.items():
             self.metrics[ts]['vitality'] = vit['val'] / vit['num']
 
     # Total number of PAs reusing software
-    def num_pas_reusing(self):
-        self.logger.info('Getting num reusing pas...')
-        if self.softwares is None:
-            self._get_softwares()
-
-        listpa = {} 
-        pa_seen = []
-        for sw in self.softwares:
-            # FIXME: non è la data corretta, da prendere da repolist
-            timestamp = self.strip_date(sw['publiccode']['releaseDate']) 
-            if timestamp not in listpa:
-                listpa[timestamp] = []
-
-            if 'usedBy' in sw['publiccode']:
-                for pa in sw['publiccode']['usedBy']:
-                    if pa.lower() not in listpa[timestamp] and pa.lower() not in pa_seen:
-                        listpa[timestamp].append(pa.lower())
-                        pa_seen.append(pa.lower())
-
-        for ts, lst_pas in listpa.items():
-            self.add_timestamp_to_metrics(ts)
-            self.metrics[ts]['num_pas_reusing'] = len(lst_pas)
+    def start_num_pas_reusing(self):
+        self.pas_reusing = DistinctCounter()
+
+    def visit_num_pas_reusing(self, timestamp, record):
+        sw, ipa = record
+        if 'usedBy' in sw['publiccode']:
+            for pa in sw['publiccode']['usedBy']:
+                self.pas_reusing.add(pa.lower(), timestamp)
+
+    def finish_num_pas_reusing(self):
+        for ts, num in self.pas_reusing.counts().items():
+            self.metrics[ts]['num_pas_reusing'] = num
@@ -1,8 +1,7 @@
 #!/usr/bin/env python3
 
-import requests
-import yaml
 from .engine import Engine
+from .catalogue import SoftwareCatalogue
 
 class CatalogoAudiences(Engine):
     """
@@ -27,7 +26,6 @@ class CatalogoAudiences(Engine):
     - https://crawler.developers.italia.it/software_tags.yml
     '''
 
-    SOFTWARES_URL = 'https://crawler.developers.italia.it/softwares.yml'
 
     softwares = None
     administrations = None
@@ -39,9 +37,7 @@ class CatalogoAudiences(Engine):
         self.metric_names = ['software_audiences']
 
     def _get_softwares(self):
-        sws = requests.get(self.SOFTWARES_URL).content
-        sws = yaml.safe_load(sws)
-        self.softwares = sws
+        self.softwares = SoftwareCatalogue.get(self)
 
     def software_audiences(self):
         self.logger.info('Getting softwares\' audiences...')
@@ -1,8 +1,7 @@
 #!/usr/bin/env python3
 
-import requests
-import yaml
 from .engine import Engine
+from .catalogue import SoftwareCatalogue
 
 class CatalogoCategories(Engine):
     """
@@ -26,7 +25,6 @@ class CatalogoCategories(Engine):
     - https://crawler.developers.italia.it/software_tags.yml
     '''
 
-    SOFTWARES_URL = 'https://crawler.developers.italia.it/softwares.yml'
 
     softwares = None
     administrations = None
@@ -38,9 +36,7 @@ class CatalogoCategories(Engine):
         self.metric_names = ['software_categories']
 
     def _get_softwares(self):
-        sws = requests.get(self.SOFTWARES_URL).content
-        sws = yaml.safe_load(sws)
-        self.softwares = sws
+        self.softwares = SoftwareCatalogue.get(self)
 
     def software_categories(self):
         self.logger.info('Getting softwares\' categories...')
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 
-import requests
-import yaml
+import json
+import os
+import time
 
 from .engine import Engine
+from .http_cache import cache_dir
+from .catalogue import SoftwareCatalogue, codice_ipa
 
 class CatalogoRegioni(Engine):
     """
@@ -27,8 +30,9 @@ class CatalogoRegioni(Engine):
     - https://crawler.developers.italia.it/software_tags.yml
     '''
 
-    SOFTWARES_URL = 'https://crawler.developers.italia.it/softwares.yml'
     INDICEPA_URL = 'https://www.indicepa.gov.it/public-services/opendata-read-service.php?dstype=FS&filename=amministrazioni.txt'
+    # The IndicePA snapshot on disk is reused for a day
+    INDICEPA_MAX_AGE = 24 * 60 * 60
 
     regioni = [
         'Abruzzo', 'Basilicata', 'Calabria', 'Campania',
@@ -53,22 +57,42 @@ class CatalogoRegioni(Engine):
                 self.metrics[regione][metric] = 0
 
     def _get_softwares(self):
-        sws = requests.get(self.SOFTWARES_URL).content
-        sws = yaml.safe_load(sws)
-        self.softwares = sws
+        self.softwares = SoftwareCatalogue.get(self)
 
     def _get_administrations(self):
-        pas = requests.get(self.INDICEPA_URL).content.decode("utf-8-sig").splitlines()
-
-        self.administrations = []
+        """
+        Loads the IndicePA administrations as a dict mapping the lowercase
+        cod_amm to the region.
+        """
+        directory = cache_dir(self.args)
+        snapshot = os.path.join(directory, 'indicepa.json') if directory else None
+
+        if snapshot:
+            try:
+                if time.time() - os.path.getmtime(snapshot) < self.INDICEPA_MAX_AGE:
+                    with open(snapshot, 'r') as f:
+                        self.administrations = json.load(f)
+                    return
+            except (OSError, ValueError):
+                pass
+
+        pas = self.get_session().get(self.INDICEPA_URL).content.decode("utf-8-sig").splitlines()
 
         titles = pas[0].split('\t')
+        cod_amm = titles.index('cod_amm')
+        regione = titles.index('Regione')
+
+        self.administrations = {}
         for p in pas[1:]:
-            arr = { }
             values = p.split('\t')
-            for i in range(0, len(values)):
-                arr[titles[i]] = values[i]
-            self.administrations.append(arr)
+            if len(values) > max(cod_amm, regione):
+                self.administrations[values[cod_amm].lower()] = values[regione]
+
+        if snapshot:
+            os.makedirs(directory, exist_ok=True)
+            with open(snapshot + '.tmp', 'w') as f:
+                json.dump(self.administrations, f)
+            os.replace(snapshot + '.tmp', snapshot)
 
     def num_pas(self):
         self.logger.info('Getting num PAs...')
@@ -79,12 +103,10 @@ class CatalogoRegioni(Engine):
 
         listpa = {}
         for sw in self.softwares:
-            if 'it' in sw['publiccode'] and 'riuso' in sw['publiccode']['it'] and 'codiceIPA' in sw['publiccode']['it']['riuso']:
-                newpa = sw['publiccode']['it']['riuso']['codiceIPA'].lower()
-                regione = None
-                for a in self.administrations:
-                    if a['cod_amm'].lower() == newpa:
-                        regione = a['Regione']
+            ipa = codice_ipa(sw)
+            if ipa is not None:
+                newpa = ipa.lower()
+                regione = self.administrations.get(newpa)
 
                 if not regione: continue
                 if regione not in listpa: listpa[regione] = []
@@ -101,12 +123,10 @@ class CatalogoRegioni(Engine):
             self._get_administrations()
 
         for sw in self.softwares:
-            if 'it' in sw['publiccode'] and 'riuso' in sw['publiccode']['it'] and 'codiceIPA' in sw['publiccode']['it']['riuso']:
-                newpa = sw['publiccode']['it']['riuso']['codiceIPA'].lower()
-                regione = None
-                for a in self.administrations:
-                    if a['cod_amm'].lower() == newpa:
-                        regione = a['Regione']
+            ipa = codice_ipa(sw)
+            if ipa is not None:
+                newpa = ipa.lower()
+                regione = self.administrations.get(newpa)
 
                 if not regione: continue
                 self.metrics[regione]['num_softwares'] += 1
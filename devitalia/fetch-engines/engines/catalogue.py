@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import threading
+from types import MappingProxyType
+
+import yaml
+
+from .http_cache import HttpCache
+
+# The libyaml loader is several times faster, fall back to the pure python one
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def codice_ipa(software):
+    """Returns the codiceIPA of the PA releasing a software for reuse, if any."""
+    publiccode = software['publiccode']
+    if 'it' in publiccode and 'riuso' in publiccode['it'] and 'codiceIPA' in publiccode['it']['riuso']:
+        return publiccode['it']['riuso']['codiceIPA']
+
+    return None
+
+
+def freeze(value):
+    """Returns a read-only copy of a parsed YAML document."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+class SoftwareCatalogue(object):
+    """
+    Process-wide provider of the software catalogue (softwares.yml).
+
+    The catalogue is downloaded and parsed once, the first time an engine asks
+    for it, and the same read-only structure is handed to every engine.
+    Unless --no-http-cache is given, the YAML is also kept on disk together
+    with its ETag, so that later runs only download it when it changed.
+
+    by_ipa() indexes the same softwares by the PA releasing them.
+    """
+
+    URL = 'https://crawler.developers.italia.it/softwares.yml'
+
+    _softwares = None
+    _by_ipa = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, engine):
+        with cls._lock:
+            if cls._softwares is None:
+                cls._softwares = freeze(yaml.load(cls._download(engine), Loader=SafeLoader))
+
+        return cls._softwares
+
+    @classmethod
+    def reset(cls):
+        """Forgets the catalogue, so that it's downloaded again on next use."""
+        with cls._lock:
+            cls._softwares = None
+            cls._by_ipa = None
+
+    @classmethod
+    def by_ipa(cls, engine):
+        """
+        Returns a read-only mapping from the lowercase codiceIPA of a PA to the
+        softwares it released for reuse.
+        """
+        softwares = cls.get(engine)
+
+        with cls._lock:
+            if cls._by_ipa is None:
+                index = {}
+                for sw in softwares:
+                    ipa = codice_ipa(sw)
+                    if ipa is not None:
+                        index.setdefault(ipa.lower(), []).append(sw)
+                cls._by_ipa = freeze(index)
+
+        return cls._by_ipa
+
+    @classmethod
+    def _download(cls, engine):
+        http_cache = HttpCache.from_args(engine.args, 'catalogue')
+
+        cached = http_cache.get(cls.URL) if http_cache else None
+
+        response = engine.get_session().get(cls.URL, headers=HttpCache.conditional_headers(cached))
+        if response.status_code == 304 and cached is not None:
+            engine.logger.debug('%s not modified, using the cached copy', cls.URL)
+            return cached['content']
+
+        response.raise_for_status()
+        if http_cache:
+            http_cache.store(cls.URL, response)
+
+        return response.content
@@ -3,8 +3,8 @@
 import json
 import concurrent.futures
 import datetime
+import itertools
 import time
-import requests
 
 from .engine import Engine
 
@@ -29,12 +29,25 @@ class Forum(Engine):
     Number of reads on the posts on the developers /italia forum: 737,370.
     """
 
+    # With --incremental only the posts newer than the last one seen and the
+    # reports from the day of the previous run are fetched
+    merge_incremental = True
+    # Date from which the reports are fetched
+    FIRST_REPORT_DATE = datetime.datetime(2017, 1, 1)
+    # Ids covered by a page of posts.json: Discourse returns the posts in a
+    # window of POSTS_PAGE ids ending at before
+    POSTS_PAGE = 50
+
     users = None
     posts = None
+    seen_post_id = 0
+    report_dates = None
+    report_since = None
 
     def __init__(self, args):
         super(Forum, self).__init__(args, 'forum')
         self.metric_names = ['num_registered_users', 'num_active_users', 'num_pageviewes', 'num_topics', 'num_posts', 'num_likes', 'num_reads']
+        self.record_sources = {'post_records': ['num_posts', 'num_likes', 'num_reads']}
 
     def _api_call(self, url, reduce=True, paginate=False):
         headers = {
@@ -51,13 +64,17 @@ class Forum(Engine):
                 curpage += 1
                 link = "{}?page={}".format(link, curpage)
 
+            attempt = 0
             while True:
-                r = requests.get(link, headers=headers)
+                r = self.get_session().get(link, headers=headers)
                 # 429 is returned when the API register too many requests from the same client.
-                # In this case wait some time and then retry the call.
+                # The session already retried the call, so wait as long as the server asks
+                # and then retry it again.
                 if r.status_code == 429:
-                    self.logger.debug("Rate limit reached, waiting 40 seconds.")
-                    time.sleep(40)
+                    delay = self.retry_delay(r, attempt)
+                    self.logger.debug("Rate limit reached, waiting %s seconds.", delay)
+                    time.sleep(delay)
+                    attempt += 1
                     self.logger.debug("Restarting API calls.")
                 else:
                     break
@@ -102,23 +119,130 @@ class Forum(Engine):
             
         return ritorno
 
+    def _fetch_all(self, url, iterlist):
+        results = self._multiple_api_calls(url, iterlist, False)
+
+        # A missing page would be lost for good once the high-water marks move on
+        if self.is_incremental() and len(results) != len(iterlist):
+            raise Exception('Could not fetch {} of {} pages of {}'.format(len(iterlist) - len(results), len(iterlist), url))
+
+        return results
+
+    def _crawl_posts(self, top, bottom):
+        """
+        Returns the posts with bottom < id <= top, walking down the ids with
+        the before cursor: past the oldest post returned, and at least a page
+        of ids at a time, so that empty ranges are skipped too.
+        """
+        posts = []
+        # Depending on the Discourse version before is inclusive or not: start
+        # above top and make consecutive pages overlap by one id
+        before = top + 1
+
+        while before > bottom:
+            page = self._api_call('https://forum.italia.it/posts.json?before=%d' % before, reduce=False)[0]['latest_posts']
+            posts.extend(p for p in page if bottom < p['id'] <= top)
+            before = min([before - self.POSTS_PAGE + 1] + [p['id'] for p in page])
+
+        return posts
+
     def _get_all_posts(self):
-        cur_posts = self._api_call('https://forum.italia.it/posts.json', reduce=False)
-        self.posts = cur_posts
-        
-        last_id = max([p['id'] for p in cur_posts[0]['latest_posts']])
-        query_ids = []
-
-        while last_id > 0:
-            last_id -= 50
-            if last_id > 0:
-                query_ids.append(last_id)
-
-        url = 'https://forum.italia.it/posts.json?before=%d'
-        results = self._multiple_api_calls(url, query_ids, False)
-        for r in results.values():
-            self.posts.extend(r)
+        """
+        Fetches the posts newer than the last one seen, splitting the ids
+        below the latest page among num_threads crawlers. Posts returned more
+        than once are kept once.
+        """
+        latest = self._api_call('https://forum.italia.it/posts.json', reduce=False)[0]['latest_posts']
+
+        # Id of the last post counted by the previous incremental run
+        if self.is_incremental():
+            if 'last_post_id' not in self.state:
+                # The previous stats already count the posts fetched again
+                for metric in self.record_sources['post_records']:
+                    if metric in self.metric_names:
+                        self.reset_metric(metric)
+            self.seen_post_id = self.state.get('last_post_id', 0)
+
+        last_id = max([p['id'] for p in latest] + [self.seen_post_id])
+        if self.is_incremental():
+            self.state['last_post_id'] = last_id
+
+        # Ranges of ids (bottom, top] left below the latest page, in whole pages.
+        # The latest page has every post newer than its oldest one, but the
+        # range of ids it covers is unknown.
+        top = min([p['id'] for p in latest], default=last_id)
+        pages = max(0, top - self.seen_post_id + self.POSTS_PAGE - 1) // self.POSTS_PAGE
+        step = -(-pages // self.num_threads) * self.POSTS_PAGE
+        ranges = [(t, max(t - step, self.seen_post_id)) for t in range(top, self.seen_post_id, -step)] if step else []
+
+        results = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            futures = {executor.submit(self._crawl_posts, t, b): (t, b) for t, b in ranges}
+            for future in concurrent.futures.as_completed(futures):
+                name = futures[future]
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    self.logger.error('Posts %d-%d generated an exception: %s', name[1] + 1, name[0], e)
+
+        # A missing range would be lost for good once the high-water mark moves on
+        if self.is_incremental() and len(results) != len(ranges):
+            raise Exception('Could not fetch {} of {} ranges of posts'.format(len(ranges) - len(results), len(ranges)))
+
+        # One byte per id newer than the last one seen
+        fetched = bytearray(last_id - self.seen_post_id + 1)
+        self.posts = []
+        for p in itertools.chain(latest, *results.values()):
+            i = p['id'] - self.seen_post_id
+            if i > 0 and not fetched[i]:
+                fetched[i] = 1
+                self.posts.append(p)
     
+    def _get_report_dates(self):
+        """
+        Returns the 30 days windows in which the reports are fetched, going
+        back to FIRST_REPORT_DATE, or to the day of the previous run with
+        --incremental.
+        """
+        if self.report_dates is None:
+            now = datetime.datetime.now()
+            since = None
+            if self.is_incremental():
+                if 'reports_since' in self.state:
+                    since = datetime.datetime.strptime(self.state['reports_since'], '%Y-%m-%d')
+                self.state['reports_since'] = now.strftime('%Y-%m-%d')
+
+            first_date = since or self.FIRST_REPORT_DATE
+            cur_startdate = now + datetime.timedelta(days=1)
+            dates = []
+
+            while cur_startdate >= first_date:
+                cur_enddate = cur_startdate - datetime.timedelta(days=1)
+                cur_startdate = cur_enddate - datetime.timedelta(days=30)
+                if since is not None:
+                    cur_startdate = max(cur_startdate, since)
+                dates.append((cur_startdate.strftime('%Y-%m-%d'), cur_enddate.strftime('%Y-%m-%d')))
+                if cur_startdate == since:
+                    break
+
+            self.report_since = since
+            self.report_dates = dates
+
+        return self.report_dates
+
+    def _get_report(self, url, metric):
+        """
+        Returns the data points of a report, zeroing the metric on the days
+        fetched again with --incremental.
+        """
+        dates = self._get_report_dates()
+        pages = self._fetch_all(url, dates)
+
+        if self.report_since is not None:
+            self.reset_metric(metric, self.strip_date(self.report_since))
+
+        return [p for c in pages for p in pages[c][0]['report']['data']]
+
     def num_registered_users(self):
         """
         Computable from https://forum.italia.it/admin/users/list/active.json by counting all
@@ -128,6 +252,10 @@ class Forum(Engine):
 
         self.logger.info('Getting registered users...')
         self.users = self._api_call('https://forum.italia.it/admin/users/list/active.json', paginate=True, reduce=True)
+
+        # The users are always fetched all again
+        if self.is_incremental():
+            self.reset_metric('num_registered_users')
         
         for u in self.users:
             timestamp = self.strip_date(u['created_at'])
@@ -146,6 +274,9 @@ class Forum(Engine):
         if self.users is None:
             self.num_registered_users()
 
+        if self.is_incremental():
+            self.reset_metric('num_active_users')
+
         for u in self.users:
             timestamp = u['last_seen_at'] if 'last_seen_at' in u else None
 
@@ -164,23 +295,11 @@ class Forum(Engine):
         """
 
         self.logger.info('Getting page views...')
-        cur_startdate = datetime.datetime.now() + datetime.timedelta(days=1)
-        dates = []
-
-        while cur_startdate >= datetime.datetime(2017, 1, 1):
-            cur_enddate = cur_startdate - datetime.timedelta(days=1)
-            cur_startdate = cur_enddate - datetime.timedelta(days=30)
-            dates.append((cur_startdate.strftime('%Y-%m-%d'), cur_enddate.strftime('%Y-%m-%d')))
-
         url = 'https://forum.italia.it/admin/reports/page_view_total_reqs.json?start_date=%s&end_date=%s'
-        pages = self._multiple_api_calls(url, dates, False)
+        data = self._get_report(url, 'num_pageviewes')
 
-        for c in pages:
-            for p in pages[c][0]['report']['data']:
-                timestamp = p['x'] + "T00:00:00Z"
-                self.add_timestamp_to_metrics(timestamp)
-
-                self.metrics[timestamp]['num_pageviewes'] += p['y']
+        store = self.metric_store()
+        store.add('num_pageviewes', store.days([p['x'] for p in data]), [p['y'] for p in data])
 
     def num_topics(self):
         """
@@ -191,25 +310,23 @@ class Forum(Engine):
         """
 
         self.logger.info('Getting topics...')
-        cur_startdate = datetime.datetime.now() + datetime.timedelta(days=1)
-        dates = []
-
-        while cur_startdate >= datetime.datetime(2017, 1, 1):
-            cur_enddate = cur_startdate - datetime.timedelta(days=1)
-            cur_startdate = cur_enddate - datetime.timedelta(days=30)
-            dates.append((cur_startdate.strftime('%Y-%m-%d'), cur_enddate.strftime('%Y-%m-%d')))
-
         url = 'https://forum.italia.it/admin/reports/topics.json?start_date=%s&end_date=%s'
-        pages = self._multiple_api_calls(url, dates, False)
+        data = self._get_report(url, 'num_topics')
 
-        for c in pages:
-            for p in pages[c][0]['report']['data']:
-                timestamp = p['x'] + "T00:00:00Z"
-                self.add_timestamp_to_metrics(timestamp)
+        store = self.metric_store()
+        store.add('num_topics', store.days([p['x'] for p in data]), [p['y'] for p in data])
 
-                self.metrics[timestamp]['num_topics'] += p['y']
+    def post_records(self):
+        """
+        Yields the posts fetched, with their creation date.
+        """
+        if self.posts is None:
+            self._get_all_posts()
+
+        for p in self.posts:
+            yield self.strip_date(p['created_at']), p
 
-    def num_posts(self):
+    def visit_num_posts(self, timestamp, post):
         """
         Computable from https://forum.italia.it/posts.json by counting the elements of the retuned array in
         the field latest_posts. For the pagination it is necessaro to use the parameter before by passing
@@ -217,18 +334,9 @@ class Forum(Engine):
         Numeric indicator of the number of messages posted in the developers /italia forum.
         """
 
-        self.logger.info('Getting posts...')
-        if self.posts is None:
-            self._get_all_posts()
-
-        for c in self.posts:
-            for p in c['latest_posts']:
-                timestamp = self.strip_date(p['created_at'])
-                self.add_timestamp_to_metrics(timestamp)
-
-                self.metrics[timestamp]['num_posts'] += 1
+        self.metrics[timestamp]['num_posts'] += 1
 
-    def num_likes(self):
+    def visit_num_likes(self, timestamp, post):
         """
         Computable from https://forum.italia.it/posts.json by summing the values of the field
         actions_summary with id equals to 2 of all the elements of the retuned array in the
@@ -238,20 +346,11 @@ class Forum(Engine):
         Numeric indicator of the likes on the posts of the developers /italia forum.
         """
 
-        self.logger.info('Getting likes...')
-        if self.posts is None:
-            self._get_all_posts()
-
-        for c in self.posts:
-            for p in c['latest_posts']:
-                timestamp = self.strip_date(p['created_at'])
-                self.add_timestamp_to_metrics(timestamp)
-
-                for a in p['actions_summary']:
-                    if a['id'] == 2:
-                        self.metrics[timestamp]['num_likes'] += a['count'] if 'count' in a else 1
+        for a in post['actions_summary']:
+            if a['id'] == 2:
+                self.metrics[timestamp]['num_likes'] += a['count'] if 'count' in a else 1
 
-    def num_reads(self):
+    def visit_num_reads(self, timestamp, post):
         """
         Computable from https://forum.italia.it/posts.json by summing all the values of the field
         reads for all the elements of the returned array in the field latest_posts.
@@ -260,13 +359,4 @@ class Forum(Engine):
         Numeric indicator of the reads of all the posts of the developers /italia forum.
         """
 
-        self.logger.info('Getting reads...')
-        if self.posts is None:
-            self._get_all_posts()
-
-        for c in self.posts:
-            for p in c['latest_posts']:
-                timestamp = self.strip_date(p['created_at'])
-                self.add_timestamp_to_metrics(timestamp)
-
-                self.metrics[timestamp]['num_reads'] += p['reads']
+        self.metrics[timestamp]['num_reads'] += post['reads']
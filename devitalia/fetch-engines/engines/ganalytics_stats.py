@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
 from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import random
+import threading
 import time
 
 from apiclient.discovery import build
@@ -11,6 +17,44 @@ from socket import timeout
 
 from .engine import Engine
 
+class DayCache(object):
+    """
+    On-disk cache of the Core Reporting results of single days, stored as a
+    JSON lines file for each profile, metrics and dimensions.
+    """
+
+    def __init__(self, directory, profile_id, metrics, dimensions):
+        key = json.dumps([profile_id, metrics, dimensions])
+        self.filename = os.path.join(directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.jsonl')
+        self.days = {}
+
+        try:
+            with open(self.filename, 'r') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.days[entry['date']] = entry['data']
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            # Truncated file: keep the days read so far
+            pass
+
+    def get(self, day):
+        return self.days.get(day)
+
+    def put(self, day, data):
+        self.days[day] = data
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            for day in sorted(self.days):
+                f.write(json.dumps({'date': day, 'data': self.days[day]}) + '\n')
+        os.replace(tmp_filename, self.filename)
+
+
 class GAnalytics(Engine):
     """
     Class that computes the statistics from Google Analytics sites: ....
@@ -33,16 +77,40 @@ class GAnalytics(Engine):
         2019-09-30T00:00:00Z,518,394,583,1780,5.41
     """
 
+    # Day of the first statistics
+    FIRST_DATE = '2017-01-01'
+    # Concurrent requests allowed by the Core Reporting API for each view
+    MAX_WORKERS = 10
+    # Rows per page of the range queries, the most the API returns
+    MAX_RESULTS = 10000
+    # Error reasons worth retrying, see
+    # https://developers.google.com/analytics/devguides/reporting/core/v3/errors
+    RETRY_REASONS = {'userRateLimitExceeded', 'rateLimitExceeded', 'quotaExceeded',
+        'backendError', 'internalServerError'}
+
     user_views = None
     auth = None
+    credentials = None
     countries = None
-    attempts_limit = 3
+    max_retries = 5
+    # Ask for whole months instead of single days
+    range_mode = True
+    # Results of the days older than settle_days are cached on disk and never
+    # fetched again, the recent ones can still change
+    use_cache = True
+    settle_days = 3
 
     def __init__(self, args):
         super(GAnalytics, self).__init__(args, 'ganalytics')
         #each metric must have a corresponding method
         self.metric_names = ['unique_visits', 'new_users', 'sessions', 'page_views', 'ext_visits', 'local_visits']
 
+        self.use_cache = getattr(args, 'ga_cache', True)
+        self.range_mode = getattr(args, 'ga_range', True)
+        self._local = threading.local()
+        if getattr(args, 'ga_settle_days', None) is not None:
+            self.settle_days = args.ga_settle_days
+
     def _auth(self):
         self.logger.info('Authenticating to Google using service account')
         # Authenticate and construct service.
@@ -123,6 +191,7 @@ class GAnalytics(Engine):
         self.logger.info('Getting google service')
         credentials = service_account.Credentials.from_service_account_info(service_account_info)
         credentials.with_scopes(scopes)
+        self.credentials = credentials
 
         # Build the service object.
         service = build(api_name, api_version, credentials=credentials)
@@ -156,7 +225,7 @@ class GAnalytics(Engine):
 
         return service, first_profile_id
 
-    def _api_call(self, metrics=[], dimensions=None, history=True):
+    def _get_auth(self):
         if (self.auth is None):
             self.logger.info('Not authenticated, authenticating...')
             service, profile_id = self._auth()
@@ -168,54 +237,246 @@ class GAnalytics(Engine):
             self.logger.info('Already authenticated, skip auth')
             service, profile_id = self.auth
 
+        return service, profile_id
+
+    def _get_day_cache(self, profile_id, metrics, dimensions):
+        if not self.use_cache:
+            return None
+
+        return DayCache(os.path.join(self.args.data_dir, '.ganalytics_cache'), profile_id, metrics, dimensions)
+
+    @staticmethod
+    def _error_reason(error):
+        try:
+            return json.loads(error.content.decode('utf-8'))['error']['errors'][0]['reason']
+        except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+            return None
+
+    def _execute(self, request, what):
+        """
+        Executes a Core Reporting API request, backing off exponentially when
+        the error reason says it can be retried. Other errors are raised.
+        """
+        retry = 0
+        while True:
+            try:
+                return request.execute()
+            except HttpError as error:
+                reason = self._error_reason(error)
+                if reason not in self.RETRY_REASONS or retry >= self.max_retries:
+                    raise Exception('An error occurred while calling Google Analytics for {} ({}): {}'
+                        .format(what, error.resp.status, reason or error._get_reason()))
+            except timeout:
+                reason = 'Socket timeout'
+                if retry >= self.max_retries:
+                    raise Exception('Too many timeouts calling Google Analytics for {}'.format(what))
+
+            delay = (2 ** retry) + random.random()
+            self.logger.debug('%s for %s, retrying in %.1f seconds', reason, what, delay)
+            time.sleep(delay)
+            retry += 1
+
+    def _api_call(self, metrics=[], dimensions=None, history=True):
+        service, profile_id = self._get_auth()
+
         # To get just one day you just need to specify
         # same day for start and end as well
         cur_date = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
         first_date = cur_date
         if history:
-            first_date = datetime.strptime('2017-01-01',"%Y-%m-%d").replace(hour=0, minute=0, second=0, microsecond=0)
+            first_date = datetime.strptime(self.FIRST_DATE, "%Y-%m-%d")
 
         ritorno = {}
 
-        attempt = 0
-        while cur_date > first_date:
-            cur_date = cur_date - timedelta(days=1)
+        cache = self._get_day_cache(profile_id, metrics, dimensions)
+        settled_date = cur_date - timedelta(days=self.settle_days)
 
-            while True:
-                try:
-                    calldata = service.data().ga().get(
-                        ids = 'ga:' + profile_id,
-                        start_date = cur_date.strftime("%Y-%m-%d"), # '2019-08-01',
-                        end_date = cur_date.strftime("%Y-%m-%d"), # '2019-08-31',
-                        metrics = ','.join(metrics),
-                        dimensions = dimensions,
-                        start_index ='1',
-                        max_results ='200').execute()
+        # Save the days fetched so far even if the run fails
+        try:
+            while cur_date > first_date:
+                cur_date = cur_date - timedelta(days=1)
+
+                day = cur_date.strftime("%Y-%m-%d")
+                if cache is not None and cur_date < settled_date:
+                    cached = cache.get(day)
+                    if cached is not None:
+                        ritorno[self.strip_date(cur_date)] = cached
+                        continue
+
+                calldata = self._execute(service.data().ga().get(
+                    ids = 'ga:' + profile_id,
+                    start_date = day, # '2019-08-01',
+                    end_date = day, # '2019-08-31',
+                    metrics = ','.join(metrics),
+                    dimensions = dimensions,
+                    start_index ='1',
+                    max_results ='200'), day)
+
+                self.logger.debug("processing: " + day)
+
+                ritorno[self.strip_date(cur_date)] = calldata
+                if cache is not None:
+                    cache.put(day, {'rows': calldata.get('rows', [])})
+
+                service.data().close()
+        finally:
+            if cache is not None:
+                cache.save()
 
-                    self.logger.debug("processing: " + cur_date.strftime("%Y-%m-%d"))
+        return ritorno
 
-                    timestamp = self.strip_date(cur_date)
-                    ritorno[timestamp] = calldata
-
-                    service.data().close()
-                    attempt = 0
-                    break
-                except HttpError:
-                    self.logger.debug("Rate limit reached, waiting 60 seconds.")
-                    time.sleep(60)
-                    self.logger.debug("Restarting API calls.")
-                except timeout:
-                    self.logger.error("Socket Timeout error received, retrying...")
-                    cur_date = cur_date + timedelta(days=1)
-                    attempt += 1
-                    break
-
-            if attempt >= self.attempts_limit:
-                self.logger.error("Too many failed attempts: " + str(attempt))
+    @staticmethod
+    def _months(first_date, last_date):
+        """Yields the first and last day of each month between first_date and last_date."""
+        start = first_date
+        while start <= last_date:
+            next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+            yield start, min(next_month - timedelta(days=1), last_date)
+            start = next_month
+
+    @staticmethod
+    def _days(start, end):
+        day = start
+        while day <= end:
+            yield day.strftime("%Y-%m-%d")
+            day = day + timedelta(days=1)
+
+    def _get_thread_service(self):
+        # The API client isn't thread safe, every worker builds its own
+        if not hasattr(self._local, 'service'):
+            self._local.service = build('analytics', 'v3', credentials=self.credentials, cache_discovery=False)
+
+        return self._local.service
+
+    def _fetch_range(self, profile_id, metrics, dimensions, start, end):
+        """
+        Returns the rows of the days between start and end, by day, paging
+        through the results of a query with ga:date as first dimension.
+        """
+        service = self._get_thread_service()
+        what = '{} - {}'.format(start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"))
+
+        rows_by_day = {}
+        start_index = 1
+        while True:
+            calldata = self._execute(service.data().ga().get(
+                ids = 'ga:' + profile_id,
+                start_date = start.strftime("%Y-%m-%d"),
+                end_date = end.strftime("%Y-%m-%d"),
+                metrics = ','.join(metrics),
+                dimensions = ','.join(['ga:date'] + dimensions),
+                samplingLevel = 'HIGHER_PRECISION',
+                start_index = str(start_index),
+                max_results = str(self.MAX_RESULTS)), what)
+
+            if calldata.get('containsSampledData'):
+                self.logger.warning('Google Analytics returned sampled data for %s', what)
+
+            rows = calldata.get('rows', [])
+            for row in rows:
+                # ga:date is YYYYMMDD
+                day = '{}-{}-{}'.format(row[0][:4], row[0][4:6], row[0][6:])
+                rows_by_day.setdefault(day, []).append(row[1:])
+
+            start_index += len(rows)
+            if not rows or start_index > calldata.get('totalResults', 0):
                 break
 
+        self.logger.debug("processed: " + what)
+
+        return rows_by_day
+
+    def _fetch_month(self, profile_id, queries, start, end):
+        return [self._fetch_range(profile_id, metrics, dimensions, start, end) for metrics, dimensions in queries]
+
+    def _api_call_range(self, queries):
+        """
+        Returns, for each (metrics, dimensions) query, the rows of every day
+        since FIRST_DATE. Whole months are queried concurrently, a worker
+        running all the queries of its month. Days are cached as in _api_call
+        with the same dimensions.
+        """
+        _, profile_id = self._get_auth()
+
+        cur_date = datetime.today().replace(hour=0, minute=0, second=0, microsecond=0)
+        first_date = datetime.strptime(self.FIRST_DATE, "%Y-%m-%d")
+        settled_date = cur_date - timedelta(days=self.settle_days)
+
+        caches = [self._get_day_cache(profile_id, metrics, ','.join(dimensions)) for metrics, dimensions in queries]
+
+        ritorno = [{} for _ in queries]
+        months = []
+        for start, end in self._months(first_date, cur_date - timedelta(days=1)):
+            cached = []
+            if self.use_cache and end < settled_date:
+                cached = [{day: cache.get(day) for day in self._days(start, end)} for cache in caches]
+
+            if cached and all(None not in days.values() for days in cached):
+                for results, days in zip(ritorno, cached):
+                    results.update((day, data['rows']) for day, data in days.items())
+            else:
+                months.append((start, end))
+
+        self.logger.info('Fetching %d months from Google Analytics', len(months))
+
+        # Save the days fetched so far even if the run fails
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.num_threads, self.MAX_WORKERS)) as executor:
+                futures = {executor.submit(self._fetch_month, profile_id, queries, start, end): (start, end)
+                    for start, end in months}
+                for future in concurrent.futures.as_completed(futures):
+                    month = future.result()
+
+                    start, end = futures[future]
+                    for results, cache, rows_by_day in zip(ritorno, caches, month):
+                        for day in self._days(start, end):
+                            results[day] = rows_by_day.get(day, [])
+                            if cache is not None:
+                                cache.put(day, {'rows': results[day]})
+        finally:
+            for cache in caches:
+                if cache is not None:
+                    cache.save()
+
         return ritorno
 
+    def _get_views_by_country(self):
+        """
+        Computes both the user views and the users by country. Users don't
+        add up across countries, a user can be seen from more than one in a
+        day, so they come from a query by day only. Sessions and page views
+        are the sum of the countries of each day.
+        """
+        by_day, by_country = self._api_call_range([
+            (['ga:users', 'ga:newUsers'], []),
+            (['ga:users', 'ga:sessions', 'ga:pageviews'], ['ga:country']),
+        ])
+        user_views = {}
+        countries = {}
+
+        for day, rows in by_country.items():
+            timestamp = self.strip_date(day)
+            user_views[timestamp] = {}
+            for row in by_day.get(day, []):
+                user_views[timestamp]['ga:users'] = int(row[0])
+                user_views[timestamp]['ga:newUsers'] = int(row[1])
+            if rows:
+                user_views[timestamp]['ga:sessions'] = sum(int(row[2]) for row in rows)
+                user_views[timestamp]['ga:pageviews'] = sum(int(row[3]) for row in rows)
+            countries[timestamp] = {'rows': [[row[0], row[1]] for row in rows]}
+
+        return user_views, countries
+
+    def _load_views(self):
+        if self.user_views is not None:
+            return
+
+        if self.range_mode:
+            self.user_views, self.countries = self._get_views_by_country()
+        else:
+            self.user_views = self._get_user_views()
+            self.countries = self._api_call(metrics=['ga:users'], dimensions='ga:country', history=False)
+
     def _get_user_views(self):
         metrics = ['ga:users','ga:newUsers','ga:sessions','ga:pageviews']
         results = self._api_call(metrics=metrics)
@@ -234,8 +495,7 @@ class GAnalytics(Engine):
 
     def unique_visits(self):
         self.logger.info('Getting num visits...')
-        if self.user_views is None:
-            self.user_views = self._get_user_views()
+        self._load_views()
 
         for cur_date, value in self.user_views.items():
             timestamp = self.strip_date(cur_date)
@@ -244,8 +504,7 @@ class GAnalytics(Engine):
 
     def new_users(self):
         self.logger.info('Getting new users...')
-        if self.user_views is None:
-            self.user_views = self._get_user_views()
+        self._load_views()
 
         for cur_date, value in self.user_views.items():
             timestamp = self.strip_date(cur_date)
@@ -254,8 +513,7 @@ class GAnalytics(Engine):
 
     def sessions(self):
         self.logger.info('Getting sessions...')
-        if self.user_views is None:
-            self.user_views = self._get_user_views()
+        self._load_views()
 
         for cur_date, value in self.user_views.items():
             timestamp = self.strip_date(cur_date)
@@ -264,8 +522,7 @@ class GAnalytics(Engine):
 
     def page_views(self):
         self.logger.info('Getting page_views...')
-        if self.user_views is None:
-            self.user_views = self._get_user_views()
+        self._load_views()
 
         for cur_date, value in self.user_views.items():
             timestamp = self.strip_date(cur_date)
@@ -273,10 +530,7 @@ class GAnalytics(Engine):
             self.metrics[timestamp]['page_views'] = value['ga:pageviews'] if 'ga:pageviews' in value else 0
 
     def ext_visits(self):
-        if self.countries is None:
-            metrics = ['ga:users']
-            dimensions = 'ga:country'
-            self.countries = self._api_call(metrics=metrics, dimensions=dimensions, history=False)
+        self._load_views()
 
         for cur_date, value in self.countries.items():
             total = 0
@@ -296,10 +550,7 @@ class GAnalytics(Engine):
                     self.logger.error('Total views are 0, not possible to divide by 0')
 
     def local_visits(self):
-        if self.countries is None:
-            metrics = ['ga:users']
-            dimensions = 'ga:country'
-            self.countries = self._api_call(metrics=metrics, dimensions=dimensions, history=False)
+        self._load_views()
 
         for cur_date, value in self.countries.items():
             total = 0
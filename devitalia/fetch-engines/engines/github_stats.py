@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
 import csv
+import concurrent.futures
+import gzip
 import json
 import re
+import threading
 import time
 from datetime import datetime, timezone
-import requests
 
 from .engine import Engine
+from .http_cache import HttpCache
 
 
 def response_is(response, code, message):
@@ -38,6 +41,48 @@ def to_datetime(s):
     return datetime.strptime(s, "%Y-%m-%dT%H:%M:%S%z")
 
 
+class RateLimitBudget(object):
+    """
+    Rate limit budget shared by all the threads calling the GitHub API.
+
+    As soon as one response reports the budget as (almost) exhausted, every
+    thread waits until X-RateLimit-Reset before sending the next request,
+    instead of each thread finding out and sleeping on its own.
+    """
+
+    def __init__(self, logger, threshold):
+        self.logger = logger
+        self.threshold = threshold
+        self.until = None
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the budget is available again."""
+        while True:
+            with self.lock:
+                until = self.until
+                now = datetime.now(tz=timezone.utc)
+                if until is None or until <= now:
+                    self.until = None
+                    return
+
+            time.sleep((until - now).total_seconds())
+
+    def pause_until(self, until):
+        with self.lock:
+            if self.until is None or until > self.until:
+                self.until = until
+                self.logger.debug("Rate limit reached, waiting until %s", until)
+
+    def update(self, response):
+        """Pause every thread if the response says the budget is running out."""
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+
+        if remaining is not None and reset is not None and int(remaining) <= self.threshold:
+            self.pause_until(datetime.fromtimestamp(int(reset), tz=timezone.utc))
+
+
 class GitHub(Engine):
     """
     Fetches the statistics from GitHub's API for repos in the /italia organization.
@@ -48,14 +93,27 @@ class GitHub(Engine):
 
     repos = None
     commits = None
+    rate_limit = None
+    http_cache = None
 
     def __init__(self, args):
         super(GitHub, self).__init__(args, 'github')
         self.metric_names = ['num_members', 'num_repos', 'num_forks', 'num_contribs', 'num_commits', 'num_pr']
 
+        # Keep one request per thread in reserve, as they can all be in flight
+        self.rate_limit = RateLimitBudget(self.logger, self.num_threads)
+
+        # GitHub doesn't count 304 Not Modified answers against the rate limit
+        self.http_cache = HttpCache.from_args(args, self.name)
+
         if args.incremental:
-            csv_path = "{}/{}.csv".format(args.data_dir, self.name)
-            with open(csv_path, "r") as f:
+            csv_path = self.previous_stats_filename()
+            if csv_path is None:
+                self.logger.error('--incremental needs the stats of a previous run in %s.', self.stats_filename())
+                raise Exception('{} not found'.format(self.stats_filename()))
+
+            opener = gzip.open if csv_path.endswith('.gz') else open
+            with opener(csv_path, "rt") as f:
                 rows = csv.reader(f)
 
                 try:
@@ -72,10 +130,12 @@ class GitHub(Engine):
     def _multiple_api_calls(self, url, repo_names, reduce=True):
         ret = {}
 
-        for repo_name in repo_names:
-            result = self._api_call(url.format(repo_name), reduce, repo_name)
-            if result is not None:
-                ret[repo_name] = result
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            futures = {executor.submit(self._api_call, url.format(r), reduce, r): r for r in repo_names}
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                if result is not None:
+                    ret[futures[future]] = result
 
         return ret
 
@@ -92,28 +152,33 @@ class GitHub(Engine):
 
         while link is not None:
             while True:
-                r = requests.get(link, headers=headers)
+                cached = self.http_cache.get(link) if self.http_cache is not None else None
+
+                self.rate_limit.wait()
+                r = self.get_session().get(link, headers=dict(headers, **HttpCache.conditional_headers(cached)))
+                self.rate_limit.update(r)
+
+                if r.status_code == 304 and cached is not None:
+                    content, next_link = cached['content'], cached['link']
+                else:
+                    content, next_link = r.content, r.headers.get('link', None)
+                    if self.http_cache is not None:
+                        self.http_cache.store(link, r)
 
                 answer = None
-                if r.content:
-                    answer = json.loads(r.content)
+                if content:
+                    answer = json.loads(content)
 
-                # If we get rate-limited, take the hint and sleep until the reset time GitHub
-                # provides us in the headers.
+                # If we get rate-limited, take the hint and make every thread wait until the
+                # reset time GitHub provides us in the headers.
                 #
                 # 429 is returned when the API register too many requests from the same client.
                 if (r.status_code == 429
                         or response_is(r, 403, 'API rate limit exceeded for user')
                         or response_is(r, 403, 'You have triggered an abuse detection mechanism')):
 
-                    now = datetime.now(tz=timezone.utc)
                     until = datetime.fromtimestamp(int(r.headers['X-RateLimit-Reset']), tz=timezone.utc)
-                    if until < now:
-                        until = now
-
-                    self.logger.debug("Rate limit reached, waiting until %s", until)
-                    time.sleep((until - now).total_seconds())
-                    self.logger.debug("Resuming API calls.")
+                    self.rate_limit.pause_until(until)
                 else:
                     break
 
@@ -121,7 +186,7 @@ class GitHub(Engine):
             if response_is(r, 409, 'Git Repository is empty'):
                 return None
 
-            if r.status_code not in [200, 422]:
+            if r.status_code not in [200, 304, 422]:
                 if answer and 'message' in answer:
                     raise Exception('An error occurred while calling GitHub ({}): {}'.format(r.status_code, answer['message']))
 
@@ -129,7 +194,7 @@ class GitHub(Engine):
 
             ret.append(answer)
 
-            link = r.headers.get('link', None)
+            link = next_link
             if link is not None and re.search(r'; rel="next"', link):
                 link = re.sub(r'.*<(.*)>; rel="next".*', r'\1', link)
             else:
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import threading
+
+
+def cache_dir(args):
+    """Directory of the on-disk HTTP caches, or None when they are disabled."""
+    if not getattr(args, 'http_cache', False):
+        return None
+
+    return args.http_cache_dir or os.path.join(args.data_dir, '.http_cache')
+
+
+class HttpCache(object):
+    """
+    On-disk cache of HTTP responses keyed by URL, used to send conditional
+    requests (If-None-Match / If-Modified-Since).
+
+    Only responses carrying an ETag or a Last-Modified header are stored.
+    When the cache grows over max_size bytes the least recently used entries
+    are evicted.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        # path -> (last access, size)
+        self.entries = {}
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.json') and os.path.isfile(path):
+                stat = os.stat(path)
+                self.entries[path] = (stat.st_mtime, stat.st_size)
+        self.size = sum(size for _, size in self.entries.values())
+
+    @classmethod
+    def from_args(cls, args, name):
+        """Returns the cache called name configured from the command line, if enabled."""
+        directory = cache_dir(args)
+        if directory is None:
+            return None
+
+        return cls(os.path.join(directory, name), args.http_cache_size * 1024 * 1024)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _load(self, url):
+        path = self._path(url)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Guard against hash collisions
+        if entry.get('url') != url:
+            return None
+
+        return entry
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Headers to revalidate a cached entry with a conditional request."""
+        if entry is None:
+            return {}
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
+
+    def get(self, url):
+        """Returns the cached entry for url, marking it as recently used."""
+        entry = self._load(url)
+        if entry is not None:
+            path = self._path(url)
+            try:
+                os.utime(path)
+                with self.lock:
+                    if path in self.entries:
+                        self.entries[path] = (os.stat(path).st_mtime, self.entries[path][1])
+            except OSError:
+                pass
+
+        return entry
+
+    def store(self, url, response):
+        """Caches a successful response, if it can be revalidated later."""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code != 200 or not (etag or last_modified):
+            return
+
+        entry = {
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'link': response.headers.get('link'),
+            'content': response.content.decode('utf-8'),
+        }
+
+        path = self._path(url)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+        stat = os.stat(path)
+        with self.lock:
+            old = self.entries.get(path)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[path] = (stat.st_mtime, stat.st_size)
+            self.size += stat.st_size
+
+            self._evict()
+
+    def _evict(self):
+        if self.size <= self.max_size:
+            return
+
+        for path, (_, size) in sorted(self.entries.items(), key=lambda e: e[1][0]):
+            if self.size <= self.max_size:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            del self.entries[path]
+            self.size -= size
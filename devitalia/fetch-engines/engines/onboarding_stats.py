@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 
-import requests
 import yaml
 
 from .engine import Engine
+from .catalogue import SoftwareCatalogue
 
 class Onboarding(Engine):
     """
@@ -27,10 +27,9 @@ class Onboarding(Engine):
     '''
 
     REPO_LIST = 'https://onboarding.developers.italia.it/repo-list'
-    SOFTWARES_URL = 'https://crawler.developers.italia.it/softwares.yml'
 
     pas = None
-    softwares = None
+    softwares_by_ipa = None
     administrations = None
 
     def __init__(self, args):
@@ -39,14 +38,12 @@ class Onboarding(Engine):
         self.metric_names = ['num_pas', 'num_pas_with_softwares']
 
     def _get_pas(self):
-        sws = requests.get(self.REPO_LIST).content
+        sws = self.get_session().get(self.REPO_LIST).content
         sws = yaml.safe_load(sws)
         self.pas = sws['registrati']
 
-    def _get_softwares(self):
-        sws = requests.get(self.SOFTWARES_URL).content
-        sws = yaml.safe_load(sws)
-        self.softwares = sws
+    def _get_softwares_by_ipa(self):
+        self.softwares_by_ipa = SoftwareCatalogue.by_ipa(self)
 
     def num_pas(self):
         self.logger.info('Getting num pas...')
@@ -67,8 +64,8 @@ class Onboarding(Engine):
         if self.pas is None:
             self._get_pas()
 
-        if self.softwares is None:
-            self._get_softwares()
+        if self.softwares_by_ipa is None:
+            self._get_softwares_by_ipa()
 
         for pa in self.pas:
             if 'timestamp' in pa:
@@ -78,11 +75,5 @@ class Onboarding(Engine):
 
             self.add_timestamp_to_metrics(timestamp)
 
-            countpa = False
-            for sw in self.softwares:
-                if 'it' in sw['publiccode'] and 'riuso' in sw['publiccode']['it'] and 'codiceIPA' in sw['publiccode']['it']['riuso']:
-                    if pa['ipa'].lower() == sw['publiccode']['it']['riuso']['codiceIPA'].lower():
-                        countpa = True
-
-            if countpa:
+            if pa['ipa'].lower() in self.softwares_by_ipa:
                 self.metrics[timestamp]['num_pas_with_softwares'] += 1
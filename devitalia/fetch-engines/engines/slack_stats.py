@@ -4,12 +4,86 @@ import json
 import concurrent.futures
 import datetime
 import re
+import threading
 import time
-from urllib.parse import urlencode
-import requests
+from urllib.parse import urlencode, urlparse
 
 from .engine import Engine
 
+
+class TokenBucket(object):
+    """
+    Token bucket pacing the calls of all the threads to a Slack API method:
+    rate calls per minute, in bursts of at most burst calls.
+    """
+
+    def __init__(self, rate, burst):
+        self.interval = 60.0 / rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until the next call can be made."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) / self.interval)
+                self.updated = now
+
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                delay = max(self.paused_until - now, (1 - self.tokens) * self.interval)
+
+            time.sleep(delay)
+
+    def pause(self, seconds):
+        """Hold every call for seconds, as asked by a Retry-After header."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class SlackScheduler(object):
+    """
+    Paces the calls to the Slack Web API. Rate limits apply to each method,
+    at the rate of the tier of the method
+    (https://api.slack.com/docs/rate-limits), so every method gets its own
+    token bucket.
+    """
+
+    # Calls per minute allowed by each tier
+    TIER_RATES = {1: 1, 2: 20, 3: 50, 4: 100}
+    METHOD_TIERS = {
+        'users.list': 2,
+        'conversations.list': 2,
+        'conversations.history': 3,
+    }
+    DEFAULT_TIER = 3
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, method):
+        with self.lock:
+            if method not in self.buckets:
+                rate = self.TIER_RATES[self.METHOD_TIERS.get(method, self.DEFAULT_TIER)]
+                # Slack tolerates short bursts over the rate
+                self.buckets[method] = TokenBucket(rate, max(1, rate // 10))
+
+            return self.buckets[method]
+
+    def acquire(self, method):
+        self.bucket(method).acquire()
+
+    def pause(self, method, seconds):
+        self.bucket(method).pause(seconds)
+
+
 class Slack(Engine):
     """
     Class that computes the statistics from Slack's workspace of /italia organization.
@@ -25,33 +99,43 @@ class Slack(Engine):
     Number of messages sent today on all channels of the developers /italia workspace: 8.
     """
 
-    num_threads = 1
+    # With --incremental today's counts are merged with the previous days,
+    # and only the messages newer than the ones already counted are fetched
+    merge_incremental = True
+    # Throttled calls are paced by the scheduler, instead of being retried
+    # by each thread on its own
+    retry_statuses = [500, 502, 503, 504]
 
     registered_users = None
     channels = None
     messages = None
+    scheduler = None
 
     def __init__(self, args):
         super(Slack, self).__init__(args, 'slack')
-        self.metric_names = ['num_registered_users']
+        self.metric_names = ['num_registered_users', 'num_channels', 'num_messages', 'num_replies']
+        self.scheduler = SlackScheduler()
 
     def _api_call(self, url, field, reduce=True, name=None):
         if name is not None:
             self.logger.debug('Calling API for channel %s...', name)
 
+        method = urlparse(url).path.rsplit('/', 1)[-1]
         params = {}
         headers = {'Authorization': 'Bearer %s' % (self.get_property('token_slack'))}
         link = url
 
         ritorno = []        
         while link is not None:
+            attempt = 0
             while True:
                 if '?' in url:
                     link = '{}&{}'.format(url, urlencode(params))
                 else:
                     link = '{}?{}'.format(url, urlencode(params))
 
-                r = requests.get(link, headers=headers)
+                self.scheduler.acquire(method)
+                r = self.get_session().get(link, headers=headers)
                 
                 answer = None
 
@@ -59,11 +143,14 @@ class Slack(Engine):
                     answer = json.loads(r.content)
 
                 # 429 is returned when the API register too many requests from the same client.
-                # In this case wait some time and then retry the call.
+                # In this case every thread calling the method waits as long as Retry-After
+                # says and then the call is retried.
                 # Check also of the call returned an error message specifying you've triggered an abuse.
                 if r.status_code == 429 or (answer and 'message' in answer and 'You have triggered an abuse detection mechanism' in answer['message']):
-                    self.logger.debug("Rate limit reached, waiting 30 second.")
-                    time.sleep(30)
+                    delay = self.retry_delay(r, attempt)
+                    self.logger.debug("Rate limit reached for %s, waiting %s seconds.", method, delay)
+                    self.scheduler.pause(method, delay)
+                    attempt += 1
                     self.logger.debug("Restarting API calls.")
                 else:
                     break
@@ -90,11 +177,11 @@ class Slack(Engine):
 
         return ritorno
 
-    def _multiple_api_calls(self, url, iterlist, field, reduce=True):
+    def _multiple_api_calls(self, urls, field, reduce=True):
         ritorno = {}
 
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_threads) as executor:
-            futures = {executor.submit(self._api_call, url.format(p), field, reduce, p): p for p in iterlist}
+            futures = {executor.submit(self._api_call, url, field, reduce, p): p for p, url in urls.items()}
             for future in concurrent.futures.as_completed(futures):
                 name = futures[future]
                 try:
@@ -121,14 +208,17 @@ class Slack(Engine):
 
     def num_channels(self):
         """
-        Computable from https://developersitalia.slack.com/api/channels.list by counting the number of
+        Computable from https://developersitalia.slack.com/api/conversations.list by counting the number of
         elements in the returned array.
         Numeric indicator of the number of channels on the workspace developers /italia.
         """
         
         self.logger.info('Getting channels users...')
-        call_response = self._api_call('https://developersitalia.slack.com/api/channels.list?exclude_archived=true', 'channels', False)
-        self.channels = call_response[0]
+        self.channels = self._api_call('https://developersitalia.slack.com/api/conversations.list?exclude_archived=true&types=public_channel&limit=200', 'channels', True)
+
+        # The channels are always fetched all again
+        if self.is_incremental() and 'num_channels' in self.metric_names:
+            self.reset_metric('num_channels')
 
         for c in self.channels:
             timestamp = self.strip_date(datetime.datetime.fromtimestamp(c['created']))
@@ -152,8 +242,34 @@ class Slack(Engine):
         if self.channels is None:
             self.num_channels()
 
-        channel_ids = [c['id'] for c in self.channels]
-        self.messages = self._multiple_api_calls('https://developersitalia.slack.com/api/conversations.history?channel={}', channel_ids, 'messages', True)
+        # With --incremental only the messages newer than the last one counted
+        # in each channel are fetched
+        oldest = {}
+        if self.is_incremental():
+            if 'channels_oldest' in self.state:
+                oldest = self.state['channels_oldest']
+            else:
+                # The previous stats already count the messages fetched again
+                for metric in ('num_messages', 'num_replies'):
+                    if metric in self.metric_names:
+                        self.reset_metric(metric)
+
+        urls = {}
+        for c in self.channels:
+            url = 'https://developersitalia.slack.com/api/conversations.history?channel={}&limit=200'.format(c['id'])
+            if c['id'] in oldest:
+                url += '&oldest={}'.format(oldest[c['id']])
+            urls[c['id']] = url
+
+        self.messages = self._multiple_api_calls(urls, 'messages', True)
+
+        # Channels that couldn't be fetched keep their previous mark
+        if self.is_incremental():
+            marks = dict(oldest)
+            for channel, messages in self.messages.items():
+                if messages:
+                    marks[channel] = max((m['ts'] for m in messages), key=float)
+            self.state['channels_oldest'] = marks
 
         for a in self.messages:
             for m in self.messages[a]:
@@ -171,6 +287,8 @@ class Slack(Engine):
         it is neccessary to check the has_more parameter. It it is true another call needs to be done
         using the ts of the last message as the latest parameter for the new call.
         Numeric indicator of the number of message replies sent on all channels on the workspace developers /italia.
+        The replies are counted on the day of the message starting the thread, from its reply_count. With
+        --incremental the messages already counted aren't fetched again, so the replies they get later are missed.
         """
 
         self.logger.info('Getting replies...')
@@ -183,4 +301,5 @@ class Slack(Engine):
                 timestamp = self.strip_date(datetime.datetime.fromtimestamp(int(ts)))
                 self.add_timestamp_to_metrics(timestamp)
 
-                self.metrics[timestamp]['num_replies'] += len(m['replies']) if 'replies' in m else 0
+                # Slack returns reply_count in place of the replies list for the apps created since 2019
+                self.metrics[timestamp]['num_replies'] += m.get('reply_count', len(m.get('replies', [])))
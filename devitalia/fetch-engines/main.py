@@ -1,35 +1,167 @@
 #!/usr/bin/env python3
 
 import argparse
+import csv
+import gzip
+import logging
+import os
+import shutil
+import threading
+import time
 from datetime import datetime
 import engines
 from apscheduler.schedulers.blocking import BlockingScheduler
 
 enabled_engines = ['GitHub', "Slack", 'Forum', 'Onboarding', 'Catalogo', 'CatalogoRegioni', 'CatalogoCategories', 'CatalogoAudiences']
 
+# Threads of the engines abandoned after --engine_timeout, by engine name: with
+# -s they can still be running when the next scheduled run starts
+abandoned_threads = {}
+
+def write_stats(engine, filename, append=False, compress=False, remove_other=False, abandoned=None):
+    """
+    Streams the rows of an engine to a CSV file, gzip-compressed if compress.
+
+    Rows are written to a temporary file next to filename, which is renamed
+    over it once complete, so that readers never see a half-written file.
+    With append the new rows are added, without header, to the existing ones,
+    taken from the file in the other format (compressed or not) if filename
+    doesn't exist yet. With remove_other the file in the other format is
+    removed, so that the loaders can't pick a stale copy.
+
+    Nothing is written if the abandoned event is set by the time the rows
+    are, and False is returned.
+    """
+    other_filename = engines.Engine.other_format(filename)
+    previous = None
+    if append:
+        previous = next((f for f in (filename, other_filename) if os.path.exists(f)), None)
+
+    tmp_filename = '{}.tmp'.format(filename)
+    try:
+        mode = 'wt'
+        if previous == filename:
+            shutil.copyfile(filename, tmp_filename)
+            mode = 'at'
+
+        opener = gzip.open if compress else open
+        with opener(tmp_filename, mode, newline='') as f:
+            if previous == other_filename:
+                previous_opener = gzip.open if previous.endswith('.gz') else open
+                with previous_opener(previous, 'rt', newline='') as p:
+                    shutil.copyfileobj(p, f)
+
+            writer = csv.writer(f, lineterminator='\n')
+
+            if previous is None:
+                writer.writerow([engine.keyname] + engine.metric_names)
+
+            for key, values in engine.rows():
+                writer.writerow(["{}".format(key)] + ["{}".format(v) for v in values])
+
+        if abandoned is not None and abandoned.is_set():
+            os.remove(tmp_filename)
+            return False
+
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+    if remove_other and os.path.exists(other_filename):
+        os.remove(other_filename)
+
+    return True
+
+
+def run_engine(args, engine, abandoned=None):
+    engine.compute_stats()
+
+    # An engine that ran over its timeout must not overwrite the CSV or the
+    # state later on: checked again once the CSV is written, as it can be slow
+    if abandoned is not None and abandoned.is_set():
+        return
+
+    # With --incremental, engines merging new data with the previous stats
+    # rewrite the whole file, the others append to it without header
+    append = args.incremental and not engine.merge_incremental
+    # The file in the other format is only dropped by a full run, it can have
+    # the history missing from the one an incremental run writes
+    written = write_stats(engine, engine.stats_filename(), append=append, compress=args.gzip,
+        remove_other=not args.incremental, abandoned=abandoned)
+    if not written or (abandoned is not None and abandoned.is_set()):
+        return
+    engine.save_state()
+
+
+def run_engines_in_parallel(args, engines_to_run):
+    """
+    Runs every engine in its own thread. A failing engine doesn't stop the
+    others, and an engine still running after args.engine_timeout seconds is
+    abandoned: its thread is left behind and its CSV and state aren't written.
+    Until that thread ends, later runs (with -s) skip the engine instead of
+    running it twice at once.
+
+    The catalogue engines share a single download of softwares.yml, the first
+    one fetching it and the others waiting for it.
+    """
+    logger = logging.getLogger('main')
+    errors = {}
+
+    def run(engine, abandoned):
+        try:
+            run_engine(args, engine, abandoned)
+        except Exception as e:
+            logger.error('%s failed: %s', engine.name, e)
+            errors[engine.name] = e
+
+    threads = {}
+    for engine in engines_to_run:
+        previous = abandoned_threads.get(engine.name)
+        if previous is not None and previous.is_alive():
+            logger.error('%s skipped, its abandoned run is still going on', engine.name)
+            errors[engine.name] = 'still running'
+            continue
+
+        abandoned = threading.Event()
+        thread = threading.Thread(target=run, args=(engine, abandoned), name=engine.name, daemon=True)
+        thread.start()
+        threads[engine.name] = (thread, abandoned)
+
+    started = time.monotonic()
+    for name, (thread, abandoned) in threads.items():
+        timeout = None
+        if args.engine_timeout:
+            timeout = max(0, args.engine_timeout - (time.monotonic() - started))
+
+        thread.join(timeout)
+        if thread.is_alive():
+            abandoned.set()
+            abandoned_threads[name] = thread
+            logger.error('%s timed out after %s seconds', name, args.engine_timeout)
+            errors[name] = 'timed out'
+
+    if errors:
+        raise Exception('Could not compute stats for {}'.format(', '.join(sorted(errors))))
+
+
 def compute_stats(args):
+    # Each (scheduled) run fetches the catalogue afresh, once for all the engines
+    engines.SoftwareCatalogue.reset()
+
+    # Engines are created upfront, as creating them (re)configures logging
+    engines_to_run = []
     for engine_name in enabled_engines:
         if not args.tool or args.tool == engine_name.lower():
-            computed_stats = ""
             engine_class = getattr(engines, engine_name)
-            engine = engine_class(args)
-            stats = engine.compute_stats()
+            engines_to_run.append(engine_class(args))
 
-            keyname = engine.keyname
-
-            # Don't add the CSV header if we are running with --incremental
-            if not args.incremental:
-                computed_stats = '{},{}\n'.format(keyname, ','.join(engine.metric_names))
-
-            for stat in sorted(stats):
-                computed_stats += "{}".format(stat)
-                for m in engine.metric_names:
-                    computed_stats += ",{}".format(stats[stat][m])
-                computed_stats += "\n"
-
-            mode = "a+" if args.incremental else "w+"
-            with open("{}/{}.csv".format(args.data_dir, engine.name), mode) as f:
-                f.write(computed_stats)
+    if args.parallel_engines:
+        run_engines_in_parallel(args, engines_to_run)
+    else:
+        for engine in engines_to_run:
+            run_engine(args, engine)
 
 
 if __name__ == "__main__":
@@ -43,7 +175,7 @@ if __name__ == "__main__":
         '--incremental',
         action="store_true",
         dest="incremental",
-        help="Resume from last date seen in the CSV file and append to it (GitHub engine only)"
+        help="Resume from last date seen in the CSV file and append to it (GitHub engine), or fetch only new data and merge it with the previous stats (Forum and Slack engines)"
     )
     mutually_excl.add_argument(
         '--since',
@@ -53,7 +185,15 @@ if __name__ == "__main__":
         default=None,
         help="Get data after this time (UTC, ISO 8601) eg. 1970-12-01T00:00:00Z (GitHub engine only)"
     )
+    parser.add_argument('--parallel-engines', action="store_true", dest="parallel_engines", help="Run the engines concurrently, a failing engine doesn't stop the others")
+    parser.add_argument('--engine_timeout', action="store", dest="engine_timeout", type=int, default=None, help="Seconds after which an engine run with --parallel-engines is abandoned, without writing its stats; with -s it's skipped until that run ends")
+    parser.add_argument('--gzip', action="store_true", dest="gzip", help="Write gzip-compressed CSV files (.csv.gz)")
     parser.add_argument('--num_threads', action="store", dest="num_threads", type=int, help="Number of threads to execute")
+    parser.add_argument('--http_retries', action="store", dest="http_retries", type=int, default=5, help="Number of retries for failed HTTP calls")
+    parser.add_argument('--http_backoff_factor', action="store", dest="http_backoff_factor", type=float, default=1.0, help="Backoff factor (seconds) between HTTP retries")
+    parser.add_argument('--no-http-cache', action="store_false", dest="http_cache", help="Don't use the on-disk HTTP cache for conditional requests (GitHub API and software catalogue)")
+    parser.add_argument('--http_cache_dir', action="store", dest="http_cache_dir", type=str, default=None, help="Directory of the HTTP cache (default: DATA_DIR/.http_cache)")
+    parser.add_argument('--http_cache_size', action="store", dest="http_cache_size", type=int, default=256, help="Maximum size of the HTTP cache, in MB")
     parser.add_argument('--token_github', action="store", dest="token_github", type=str, help="GitHub API key")
     parser.add_argument('--token_slack', action="store", dest="token_slack", type=str, help="Slack app token")
     parser.add_argument('--forum_api_key', action="store", dest="forum_api_key", type=str, help="Forum API key")
@@ -64,6 +204,9 @@ if __name__ == "__main__":
     parser.add_argument('--google_client_email', action="store", dest="google_client_email", type=str, help="Google Analytics Client Email")
     parser.add_argument('--google_client_id', action="store", dest="google_client_id", type=str, help="Google Analytics Client ID")
     parser.add_argument('--google_client_x509_cert_url', action="store", dest="google_client_x509_cert_url", type=str, help="Google Analytics Client X509 Cert Url")
+    parser.add_argument('--no-ga-cache', action="store_false", dest="ga_cache", help="Don't use the on-disk cache of the Google Analytics daily results")
+    parser.add_argument('--ga-per-day', action="store_false", dest="ga_range", help="Query Google Analytics one day at a time instead of whole months")
+    parser.add_argument('--ga_settle_days', action="store", dest="ga_settle_days", type=int, default=3, help="Recent days whose Google Analytics results are always fetched again")
 
     args = parser.parse_args()
 
@@ -4,6 +4,7 @@ set -e
 
 SCRIPTDIR=${SCRIPTDIR:-/opt/ingestion_scripts}
 DEVITALIA_DATADIR=${DEVITALIA_DATADIR:-SCRIPTDIR/devitalia/data}
+DEVITALIA_WORKERS=${DEVITALIA_WORKERS:-4}
 MONGODB_HOSTNAME=${MONGODB_HOSTNAME:-unset}
 MONGODB_DATABASE=${MONGODB_DATABASE:-unset}
 MONGODB_USERNAME=${MONGODB_USERNAME:-unset}
@@ -36,4 +37,5 @@ python3 ${SCRIPTDIR}/devitalia/main.py \
     --mongodb-db "${MONGODB_DATABASE}" \
     --mongodb-user "${MONGODB_USERNAME}" \
     --mongodb-pass "${MONGODB_PASSWORD}" \
-    --mongodb-authdb "${MONGODB_AUTHDB}"
+    --mongodb-authdb "${MONGODB_AUTHDB}" \
+    --workers "${DEVITALIA_WORKERS}"
@@ -1,10 +1,184 @@
 #!/usr/bin/env python3
 
-from datetime import datetime
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
 
+import csv
+import gzip
+import json
 import os
 import logging
 import logging.config
+import re
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+# Upper bound (seconds) for the exponential backoff
+MAX_BACKOFF = 120
+
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+# Distinct days (and other timestamps) whose normalized form is memoized
+DATE_CACHE_SIZE = 16384
+# Timestamps bucketed by Engine.strip_date without parsing them: YYYY-MM-DD,
+# YYYY-MM-DDTHH:MM:SSZ and YYYY-MM-DDTHH:MM:SS.fffZ with a valid time. The
+# day is checked by midnight().
+FAST_TIMESTAMP = re.compile(
+    r'[0-9]{4}-[0-9]{2}-[0-9]{2}(T([01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9](\.[0-9]{1,6})?Z)?\Z')
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def midnight(day):
+    """
+    Returns the timestamp of the midnight of a YYYY-MM-DD day, checking that
+    the day is valid.
+    """
+    return datetime.strptime(day, '%Y-%m-%d').strftime(TIMESTAMP_FORMAT)
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_day(in_timestamp):
+    """
+    Slow path of Engine.strip_date, for the strings which are not plain
+    YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS[.fff]Z timestamps.
+    """
+    if len(in_timestamp) <= 10:
+        timestamp = datetime.strptime(in_timestamp, '%Y-%m-%d')
+    else:
+        try:
+            timestamp = datetime.strptime(in_timestamp, TIMESTAMP_FORMAT)
+        except ValueError:
+            timestamp = datetime.strptime(in_timestamp, '%Y-%m-%dT%H:%M:%S.%fZ')
+
+    return timestamp.strftime('%Y-%m-%dT00:00:00Z')
+
+def parse_number(value):
+    """Converts a value read back from a stats CSV to a number, when it is one."""
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+class DistinctCounter(object):
+    """
+    Incremental counter of distinct keys, remembering the timestamp at which
+    each key was first seen.
+    """
+
+    def __init__(self):
+        self.first_seen = {}
+
+    def add(self, key, timestamp=None):
+        """
+        Records key as seen at timestamp, unless it was already seen.
+        Returns True if the key is new.
+        """
+        if key in self.first_seen:
+            return False
+
+        self.first_seen[key] = timestamp
+        return True
+
+    def __contains__(self, key):
+        return key in self.first_seen
+
+    def __len__(self):
+        return len(self.first_seen)
+
+    def counts(self):
+        """Returns the number of new keys by timestamp of first sighting."""
+        counts = {}
+        for timestamp in self.first_seen.values():
+            counts[timestamp] = counts.get(timestamp, 0) + 1
+
+        return counts
+
+class MetricStore(object):
+    """
+    Columnar store of daily metrics: one numpy column per metric, indexed by
+    day (days since the epoch, relative to the first day stored).
+
+    Events are pushed in bulk as arrays of days, optionally weighted, and
+    accumulated with bincount instead of one dict entry at a time.
+    """
+
+    def __init__(self, metric_names):
+        self.metric_names = list(metric_names)
+        self.first_day = None
+        self.present = np.zeros(0, dtype=bool)
+        self.columns = {metric: np.zeros(0, dtype=np.int64) for metric in self.metric_names}
+
+    @staticmethod
+    def days(timestamps):
+        """Converts ISO 8601 dates or timestamps to days since the epoch."""
+        return np.array([t[:10] for t in timestamps], dtype='datetime64[D]').astype(np.int64)
+
+    def copy(self):
+        store = MetricStore(self.metric_names)
+        store.first_day = self.first_day
+        store.present = self.present.copy()
+        store.columns = {metric: column.copy() for metric, column in self.columns.items()}
+        return store
+
+    def _grow(self, days):
+        first, last = int(days.min()), int(days.max())
+        if self.first_day is None:
+            self.first_day = first
+
+        start = min(first, self.first_day)
+        end = max(last + 1, self.first_day + len(self.present))
+
+        before = self.first_day - start
+        after = end - self.first_day - len(self.present)
+        if before or after:
+            self.present = np.pad(self.present, (before, after))
+            for metric, column in self.columns.items():
+                self.columns[metric] = np.pad(column, (before, after))
+            self.first_day = start
+
+    def add(self, metric, days, values=None):
+        """
+        Adds one event (or values, when given) to metric for each day in days.
+        """
+        days = np.asarray(days, dtype=np.int64)
+        if len(days) == 0:
+            return
+
+        self._grow(days)
+        index = days - self.first_day
+        self.present[index] = True
+
+        if values is None:
+            counts = np.bincount(index, minlength=len(self.present))
+        else:
+            values = np.asarray(values)
+            counts = np.bincount(index, weights=values, minlength=len(self.present))
+            if values.dtype.kind != 'f':
+                counts = counts.astype(np.int64)
+
+        column = self.columns[metric]
+        if counts.dtype.kind == 'f' and column.dtype.kind != 'f':
+            column = column.astype(np.float64)
+        self.columns[metric] = column + counts
+
+    def rows(self):
+        """
+        Yields (timestamp, values) for each day with events, in order.
+        """
+        if self.first_day is None:
+            return
+
+        index = np.flatnonzero(self.present)
+        timestamps = np.datetime_as_string((index + self.first_day).astype('datetime64[D]')).tolist()
+        values = [self.columns[metric][index].tolist() for metric in self.metric_names]
+
+        for timestamp, row in zip(timestamps, zip(*values)):
+            yield timestamp + 'T00:00:00Z', list(row)
 
 class Engine(object):
     name = None
@@ -15,6 +189,22 @@ class Engine(object):
     num_threads = 1
     metrics = {}
     metric_names = []
+    # Metrics computed in a single pass over a source of records: maps the
+    # name of the method yielding (timestamp, record) pairs to the metrics
+    # visiting them (see compute_stats)
+    record_sources = {}
+    # Columnar store for engines pushing daily events in bulk (see metric_store)
+    store = None
+    # Engines supporting --incremental by fetching only the data newer than the
+    # high-water marks in self.state and merging it with the previous stats
+    merge_incremental = False
+    state = None
+
+    session = None
+    http_retries = 5
+    http_backoff_factor = 1.0
+    # Statuses of the calls retried by the session
+    retry_statuses = RETRY_STATUSES
 
     def __init__(self, args, engine_name):
         self.args = args
@@ -23,6 +213,11 @@ class Engine(object):
         self.num_threads = int(self.get_property('num_threads'))
         self.metrics = {}
 
+        if getattr(args, 'http_retries', None) is not None:
+            self.http_retries = args.http_retries
+        if getattr(args, 'http_backoff_factor', None) is not None:
+            self.http_backoff_factor = args.http_backoff_factor
+
         logging_conf = os.path.join(os.path.abspath(os.path.dirname(__file__)), '../logging.conf')
         logging.config.fileConfig(fname=logging_conf, disable_existing_loggers=False)
         self.logger = logging.getLogger(engine_name)
@@ -34,26 +229,175 @@ class Engine(object):
         # hack to keep backslah not doubled from encodind in env vars
         return bytes(os.getenv(property_name.upper()), 'latin1').decode('unicode_escape')
 
+    def get_session(self):
+        """
+        Returns the HTTP session of this engine: connections are kept alive and
+        pooled (one per thread), responses are gzip-compressed and failed calls
+        are retried with exponential backoff, honouring Retry-After.
+        """
+        if self.session is None:
+            retry = Retry(total=self.http_retries,
+                backoff_factor=self.http_backoff_factor,
+                status_forcelist=self.retry_statuses,
+                respect_retry_after_header=True,
+                raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=self.num_threads,
+                pool_maxsize=self.num_threads,
+                max_retries=retry)
+
+            session = requests.Session()
+            session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self.session = session
+
+        return self.session
+
+    def retry_delay(self, response, attempt):
+        """
+        Seconds to wait before retrying a throttled call: the value of the
+        Retry-After header when present, exponential backoff otherwise.
+        """
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    until = parsedate_to_datetime(retry_after)
+                    return max(0.0, (until - datetime.now(tz=timezone.utc)).total_seconds())
+                except (TypeError, ValueError):
+                    pass
+
+        return min(MAX_BACKOFF, self.http_backoff_factor * (2 ** attempt))
+
     def strip_date(self, in_timestamp):
         """
         Function that converts a datetime to the string of the datetime at the
         midnight of the day passed.
+
+        ISO 8601 strings are bucketed by slicing their YYYY-MM-DD prefix once
+        their time is checked, the other formats are parsed once and memoized.
         """
         if isinstance(in_timestamp, str):
-            if len(in_timestamp) <= 10:
-                timestamp = datetime.strptime(in_timestamp, '%Y-%m-%d')
-            else:
-                try:
-                    timestamp = datetime.strptime(in_timestamp, '%Y-%m-%dT%H:%M:%SZ')
-                except ValueError:
-                    timestamp = datetime.strptime(in_timestamp, '%Y-%m-%dT%H:%M:%S.%fZ')
-        else:
-            timestamp = in_timestamp
+            if FAST_TIMESTAMP.match(in_timestamp):
+                return midnight(in_timestamp[:10])
+
+            return parse_day(in_timestamp)
+
+        return in_timestamp.strftime('%Y-%m-%dT00:00:00Z')
+
+    def stats_filename(self):
+        """Path of the CSV file with the stats of this engine."""
+        filename = os.path.join(self.args.data_dir, '{}.csv'.format(self.name))
+        return filename + '.gz' if getattr(self.args, 'gzip', False) else filename
+
+    @staticmethod
+    def other_format(filename):
+        """The same stats file in the other format, compressed or not."""
+        return filename[:-len('.gz')] if filename.endswith('.gz') else filename + '.gz'
+
+    def previous_stats_filename(self):
+        """
+        Path of the existing CSV file with the stats of this engine, in either
+        format, or None if there is none.
+        """
+        for filename in (self.stats_filename(), self.other_format(self.stats_filename())):
+            if os.path.exists(filename):
+                return filename
+
+        return None
+
+    def state_filename(self):
+        return os.path.join(self.args.data_dir, '.{}.state.json'.format(self.name))
 
-        timestamp = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
-        timestamp = timestamp.strftime('%Y-%m-%dT%H:%M:%SZ')
+    def is_incremental(self):
+        return self.merge_incremental and bool(getattr(self.args, 'incremental', False))
 
-        return timestamp
+    def load_state(self):
+        """
+        Loads the high-water marks saved by the previous incremental run.
+        """
+        self.state = {}
+        try:
+            with open(self.state_filename(), 'r') as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.logger.info('No previous state, fetching everything')
+
+    def save_state(self):
+        """
+        Saves the high-water marks, once the stats computed with them are
+        safely written.
+        """
+        if self.state is None:
+            return
+
+        filename = self.state_filename()
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(self.state, f)
+        os.replace(filename + '.tmp', filename)
+
+    def load_previous_stats(self):
+        """
+        Loads the stats written by the previous run into self.metrics, so that
+        the metrics computed on new data are merged with them by key. Returns
+        whether there were any.
+        """
+        filename = self.previous_stats_filename()
+        if filename is None:
+            self.logger.info('%s not found, computing all the stats', self.stats_filename())
+            return False
+
+        opener = gzip.open if filename.endswith('.gz') else open
+        with opener(filename, 'rt', newline='') as f:
+            for row in csv.DictReader(f):
+                key = row.pop(self.keyname)
+                self.add_timestamp_to_metrics(key)
+                for metric in self.metric_names:
+                    if row.get(metric):
+                        self.metrics[key][metric] = parse_number(row[metric])
+
+        return True
+
+    def reset_metric(self, metric, since=None):
+        """
+        Zeroes a metric for all the keys, or for the ones from since onwards,
+        before computing it again on data fetched afresh.
+        """
+        for key, values in self.metrics.items():
+            if since is None or key >= since:
+                values[metric] = 0
+
+    def metric_store(self):
+        """
+        Returns the columnar store of this engine, for metrics keyed by day.
+        Its rows are merged with the ones in self.metrics by rows().
+        """
+        if self.store is None:
+            self.store = MetricStore(self.metric_names)
+
+        return self.store
+
+    def rows(self):
+        """
+        Yields (key, values) for every key of the metrics, sorted by key, the
+        values following metric_names.
+        """
+        if self.store is None:
+            for key in sorted(self.metrics):
+                yield key, [self.metrics[key][m] for m in self.metric_names]
+            return
+
+        store = self.store
+        if self.metrics:
+            store = store.copy()
+            keys = list(self.metrics)
+            days = store.days(keys)
+            for m in self.metric_names:
+                store.add(m, days, [self.metrics[k][m] for k in keys])
+
+        yield from store.rows()
 
     def add_timestamp_to_metrics(self, timestamp):
         """
@@ -65,9 +409,62 @@ class Engine(object):
             for metric in self.metric_names:
                 self.metrics[timestamp][metric] = 0
 
+    def get_visitor(self, metric):
+        """Returns the method visiting the records for metric."""
+        return getattr(self, 'visit_' + metric)
+
+    def visit_records(self, records, metrics):
+        """
+        Computes metrics in a single pass over records, an iterable of
+        (timestamp, record) pairs.
+
+        Each metric is made of a visit_<metric>(timestamp, record) method,
+        called for every record, and of the optional start_<metric>() and
+        finish_<metric>() methods, called before and after the pass.
+        Metrics sharing the same visitor, see get_visitor(), are visited
+        with a single call.
+        """
+        self.logger.info('Getting %s...', ', '.join(metrics))
+
+        for metric in metrics:
+            start = getattr(self, 'start_' + metric, None)
+            if start is not None:
+                start()
+
+        visitors = list(dict.fromkeys(self.get_visitor(metric) for metric in metrics))
+        for timestamp, record in records:
+            self.add_timestamp_to_metrics(timestamp)
+            for visit in visitors:
+                visit(timestamp, record)
+
+        for metric in metrics:
+            finish = getattr(self, 'finish_' + metric, None)
+            if finish is not None:
+                finish()
+
     def compute_stats(self):
+        """
+        Computes every metric of the engine: the metrics listed in
+        record_sources with one pass per source, the others by calling the
+        method with the same name of the metric.
+        """
+        if self.is_incremental():
+            self.load_state()
+            # The high-water marks are useless without the stats counted up
+            # to them: fetch everything again
+            if not self.load_previous_stats():
+                self.state = {}
+
+        visited = set()
+        for source, metrics in self.record_sources.items():
+            metrics = [m for m in self.metric_names if m in metrics]
+            if metrics:
+                self.visit_records(getattr(self, source)(), metrics)
+                visited.update(metrics)
+
         for metric in self.metric_names:
-            method_to_call = getattr(self, metric)
-            method_to_call()
+            if metric not in visited:
+                method_to_call = getattr(self, metric)
+                method_to_call()
 
         return self.metrics
@@ -1,10 +1,8 @@
+import concurrent.futures
 import json
-import requests
 from requests.auth import HTTPBasicAuth
-import numpy as np
 import re
-from datetime import datetime
-from .engine import Engine
+from .engine import Engine, DistinctCounter
 
 class Newsletter(Engine):
     """
@@ -20,15 +18,28 @@ class Newsletter(Engine):
     uuid_regex = r".\b[0-9a-f]{8}\b-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-\b[0-9a-f]{12}\b$"
     # website start date 2021-11-15
     website_start_date = '2021-11-15'
-    result = None
+    # Metrics counting the subscribers by the value of one of their vars,
+    # as field -> value -> metric: a new segment only needs a new entry here
+    GROUP_BY = {
+      'enteSelect': {
+        'dipendente-administration': 'group_by_pa_employee',
+        'dirigente-administration': 'group_by_pa_executive',
+        'dirigente-it-administration': 'group_by_pa_it_executive',
+        'other': 'group_by_pa_other',
+      },
+      'representative': {
+        'public-administration': 'group_by_representative_pa',
+        'fornitore-it': 'group_by_representative_supplier',
+        'other': 'group_by_representative_other',
+      },
+    }
+    GROUP_BY_METRICS = [metric for values in GROUP_BY.values() for metric in values.values()]
 
     def __init__(self, args):
       super(Newsletter, self).__init__(args, 'newsletter')
-      #each metric must have a corresponding method
-      self.metric_names = ['total_subscriber', 'group_by_pa_employee',
-        'group_by_pa_executive', 'group_by_pa_it_executive', 'group_by_pa_other',
-        'group_by_representative_pa', 'group_by_representative_supplier', 'group_by_representative_other'
-        ]
+      #each metric must have a corresponding visitor
+      self.metric_names = ['total_subscriber'] + self.GROUP_BY_METRICS
+      self.record_sources = {'subscriber_records': self.metric_names}
 
 
     def flattenjson(self, b, delim):
@@ -43,18 +54,13 @@ class Newsletter(Engine):
 
       return val
 
-    def unique(self, list1):
-      unique_list_set = []
-      unique_list = []
+    def unique(self, items):
+      addresses = DistinctCounter()
 
-      # traverse for all elements
-      for x in list1:
-        # check if exists in unique_list or not
-        if x['address'] not in unique_list_set:
-          unique_list_set.append(x['address'])
-          unique_list.append(x)
-
-      return unique_list
+      # traverse for all elements, keeping the first item for each address
+      for x in items:
+        if addresses.add(x['address']):
+          yield x
 
     def cleanUUIDAndMessage(self, item):
       o = re.compile(self.uuid_regex).split(item['address'])
@@ -64,167 +70,73 @@ class Newsletter(Engine):
         item['vars']['message'] = item['vars']['message'].replace("\n", "")
       return item
 
-    def makeRequest(self, url, items):
+    def makeRequest(self, url):
+      """
+      Yields the members of the list page by page, following the paging.next
+      links of Mailgun. The next page is downloaded while the current one is
+      consumed, so that at most two pages are held in memory.
+      """
       API_KEY = self.get_property('token_mailgun')
-      response = requests.get(f"{url}",
-                  auth = HTTPBasicAuth('api', API_KEY))
-
-      if response.status_code != 200:
-        self.logger.error(f'error fetching data: {response.content}')
-        return []
-
-      content = json.loads(response.text)
-      responseItems = content.get("items")
-      nextPage = content["paging"]["next"]
-
-      items = np.concatenate((items, responseItems))
-
-      if nextPage and len(responseItems) > 0:
-        self.logger.debug(f'next page present, here url: {nextPage}')
-        return self.makeRequest(nextPage, items)
-
-      return items
-
-    def total_subscriber(self):
-      if self.result is None:
-        self.retrieve_setup()
-
-      self.logger.info('Getting total subscriber...')
-      for val in self.result:
-        cur_date = self.normalize_timestamp(val['vars'])
-        timestamp = self.strip_date(cur_date)
-        self.metrics[timestamp]['total_subscriber'] +=1
-
-    def group_by_pa_employee(self):
-      if self.result is None:
-        self.retrieve_setup()
-
-      self.logger.info('Getting by PA employee...')
-      for val in self.result:
-        cur_date = self.normalize_timestamp(val['vars'])
-        timestamp = self.strip_date(cur_date)
-
-        enteSelect = val['vars']['enteSelect']
-        if enteSelect == 'dipendente-administration':
-          self.metrics[timestamp]['group_by_pa_employee'] +=1
-
-    def group_by_pa_it_executive(self):
-      if self.result is None:
-        self.retrieve_setup()
+      session = self.get_session()
 
-      self.logger.info('Getting by PA IT executive...')
-      for val in self.result:
-        cur_date = self.normalize_timestamp(val['vars'])
-        timestamp = self.strip_date(cur_date)
-
-        enteSelect = val['vars']['enteSelect']
-        if enteSelect == 'dirigente-it-administration':
-          self.metrics[timestamp]['group_by_pa_it_executive'] +=1
-
-    def group_by_pa_executive(self):
-      if self.result is None:
-        self.retrieve_setup()
-
-      self.logger.info('Getting by PA executive...')
-      for val in self.result:
-        cur_date = self.normalize_timestamp(val['vars'])
-        timestamp = self.strip_date(cur_date)
-
-        enteSelect = val['vars']['enteSelect']
-        if enteSelect == 'dirigente-administration':
-          self.metrics[timestamp]['group_by_pa_executive'] +=1
-
-    def group_by_pa_other(self):
-      if self.result is None:
-        self.retrieve_setup()
+      def fetch(url):
+        return session.get(f"{url}", auth = HTTPBasicAuth('api', API_KEY))
 
-      self.logger.info('Getting by PA other...')
-      for val in self.result:
-        cur_date = self.normalize_timestamp(val['vars'])
-        timestamp = self.strip_date(cur_date)
+      count = 0
+      with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(fetch, url)
+        while pending is not None:
+          response = pending.result()
+          pending = None
 
-        enteSelect = val['vars']['enteSelect']
-        if enteSelect == 'other':
-          self.metrics[timestamp]['group_by_pa_other'] +=1
+          if response.status_code != 200:
+            self.logger.error(f'error fetching data: {response.content}')
+            raise Exception(f'Could not fetch the newsletter members ({response.status_code})')
 
-    def group_by_representative_supplier(self):
-      if self.result is None:
-        self.retrieve_setup()
+          content = json.loads(response.text)
+          responseItems = content.get("items") or []
+          nextPage = content["paging"]["next"]
 
-      self.logger.info('Getting by representative supplier...')
-      for val in self.result:
-        cur_date = self.normalize_timestamp(val['vars'])
-        timestamp = self.strip_date(cur_date)
+          if nextPage and len(responseItems) > 0:
+            self.logger.debug(f'next page present, here url: {nextPage}')
+            pending = executor.submit(fetch, nextPage)
 
-        enteSelect = val['vars']['representative']
-        if enteSelect == 'fornitore-it':
-          self.metrics[timestamp]['group_by_representative_supplier'] +=1
+          count += len(responseItems)
+          yield from responseItems
 
-    def group_by_representative_pa(self):
-      if self.result is None:
-        self.retrieve_setup()
+      self.logger.info(f'found {count} items')
 
-      self.logger.info('Getting by representative PA...')
-      for val in self.result:
+    def subscriber_records(self):
+      for val in self.all_metrics():
         cur_date = self.normalize_timestamp(val['vars'])
-        timestamp = self.strip_date(cur_date)
+        yield self.strip_date(cur_date), val['vars']
 
-        enteSelect = val['vars']['representative']
-        if enteSelect == 'public-administration':
-          self.metrics[timestamp]['group_by_representative_pa'] +=1
+    def visit_total_subscriber(self, timestamp, vars):
+      self.metrics[timestamp]['total_subscriber'] +=1
 
-    def group_by_representative_other(self):
-      if self.result is None:
-        self.retrieve_setup()
-
-      self.logger.info('Getting by representative other...')
-      for val in self.result:
-        cur_date = self.normalize_timestamp(val['vars'])
-        timestamp = self.strip_date(cur_date)
+    def get_visitor(self, metric):
+      if metric in self.GROUP_BY_METRICS:
+        return self.visit_group_by
+      return super(Newsletter, self).get_visitor(metric)
 
-        enteSelect = val['vars']['representative']
-        if enteSelect == 'other':
-          self.metrics[timestamp]['group_by_representative_other'] +=1
+    def visit_group_by(self, timestamp, vars):
+      counts = self.metrics[timestamp]
+      for field, metrics in self.GROUP_BY.items():
+        metric = metrics.get(vars.get(field))
+        if metric is not None:
+          counts[metric] += 1
 
     def normalize_timestamp(self, vars):
       # at the beginning records did not have timestamp data
       if 'timestamp' in vars:
-        return datetime.strptime(vars['timestamp'], '%Y-%m-%dT%H:%M:%S.%f%z').replace(hour=0, minute=0, second=0, microsecond=0)
+        # YYYY-MM-DD in the offset of the timestamp, as parsing it would give
+        return vars['timestamp'][:10]
       else:
-        return datetime.strptime(self.website_start_date, '%Y-%m-%d')
+        return self.website_start_date
 
     # retrieve data
     def all_metrics(self):
-      items = self.makeRequest(self.base_url, [])
-      self.logger.info(f'found {len(items)} items')
+      items = self.makeRequest(self.base_url)
 
       # clean from UUID and get only unique
-      return self.unique(list(map(self.cleanUUIDAndMessage, items)))
-
-    # get data, setup timing, init counters
-    def retrieve_setup(self):
-      if self.result is None:
-        self.result = self.all_metrics()
-
-      self.logger.info('setting things up...')
-      for val in self.result:
-        cur_date = self.normalize_timestamp(val['vars'])
-        timestamp = self.strip_date(cur_date)
-        self.add_timestamp_to_metrics(timestamp)
-
-        # init counters
-        self.metrics[timestamp]['total_subscriber'] = 0
-        if 'group_by_pa_employee' not in self.metrics[timestamp]:
-          self.metrics[timestamp]['group_by_pa_employee'] = 0
-        if 'group_by_pa_it_executive' not in self.metrics[timestamp]:
-          self.metrics[timestamp]['group_by_pa_it_executive'] = 0
-        if 'group_by_pa_executive' not in self.metrics[timestamp]:
-          self.metrics[timestamp]['group_by_pa_executive'] = 0
-        if 'group_by_pa_other' not in self.metrics[timestamp]:
-          self.metrics[timestamp]['group_by_pa_other'] = 0
-        if 'group_by_representative_supplier' not in self.metrics[timestamp]:
-          self.metrics[timestamp]['group_by_representative_supplier'] = 0
-        if 'group_by_representative_pa' not in self.metrics[timestamp]:
-          self.metrics[timestamp]['group_by_representative_pa'] = 0
-        if 'group_by_representative_other' not in self.metrics[timestamp]:
-          self.metrics[timestamp]['group_by_representative_other'] = 0
+      return self.unique(map(self.cleanUUIDAndMessage, items))
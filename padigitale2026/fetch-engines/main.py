@@ -1,35 +1,79 @@
 #!/usr/bin/env python3
 
 import argparse
+import csv
+import gzip
+import os
+import shutil
 from datetime import datetime
 import engines
 from apscheduler.schedulers.blocking import BlockingScheduler
 
 enabled_engines = ['Newsletter']
 
+def write_stats(engine, filename, append=False, compress=False, remove_other=False):
+    """
+    Streams the rows of an engine to a CSV file, gzip-compressed if compress.
+
+    Rows are written to a temporary file next to filename, which is renamed
+    over it once complete, so that readers never see a half-written file.
+    With append the new rows are added, without header, to the existing ones,
+    taken from the file in the other format (compressed or not) if filename
+    doesn't exist yet. With remove_other the file in the other format is
+    removed, so that the loaders can't pick a stale copy.
+    """
+    other_filename = engines.Engine.other_format(filename)
+    previous = None
+    if append:
+        previous = next((f for f in (filename, other_filename) if os.path.exists(f)), None)
+
+    tmp_filename = '{}.tmp'.format(filename)
+    try:
+        mode = 'wt'
+        if previous == filename:
+            shutil.copyfile(filename, tmp_filename)
+            mode = 'at'
+
+        opener = gzip.open if compress else open
+        with opener(tmp_filename, mode, newline='') as f:
+            if previous == other_filename:
+                previous_opener = gzip.open if previous.endswith('.gz') else open
+                with previous_opener(previous, 'rt', newline='') as p:
+                    shutil.copyfileobj(p, f)
+
+            writer = csv.writer(f, lineterminator='\n')
+
+            if previous is None:
+                writer.writerow([engine.keyname] + engine.metric_names)
+
+            for key, values in engine.rows():
+                writer.writerow(["{}".format(key)] + ["{}".format(v) for v in values])
+
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+    if remove_other and os.path.exists(other_filename):
+        os.remove(other_filename)
+
+
 def compute_stats(args):
     for engine_name in enabled_engines:
         if not args.tool or args.tool == engine_name.lower():
-            computed_stats = ""
             engine_class = getattr(engines, engine_name)
             engine = engine_class(args)
-            stats = engine.compute_stats()
-
-            keyname = engine.keyname
-
-            # Don't add the CSV header if we are running with --incremental
-            if not args.incremental:
-                computed_stats = '{},{}\n'.format(keyname, ','.join(engine.metric_names))
-
-            for stat in sorted(stats):
-                computed_stats += "{}".format(stat)
-                for m in engine.metric_names:
-                    computed_stats += ",{}".format(stats[stat][m])
-                computed_stats += "\n"
+            engine.compute_stats()
 
-            mode = "a+" if args.incremental else "w+"
-            with open("{}/{}.csv".format(args.data_dir, engine.name), mode) as f:
-                f.write(computed_stats)
+            # With --incremental, engines merging new data with the previous stats
+            # rewrite the whole file, the others append to it without header
+            append = args.incremental and not engine.merge_incremental
+            # The file in the other format is only dropped by a full run, it can have
+            # the history missing from the one an incremental run writes
+            write_stats(engine, engine.stats_filename(), append=append, compress=args.gzip,
+                remove_other=not args.incremental)
+            engine.save_state()
 
 
 if __name__ == "__main__":
@@ -53,7 +97,10 @@ if __name__ == "__main__":
         default=None,
         help="Get data after this time (UTC, ISO 8601) eg. 1970-12-01T00:00:00Z (GitHub engine only)"
     )
+    parser.add_argument('--gzip', action="store_true", dest="gzip", help="Write gzip-compressed CSV files (.csv.gz)")
     parser.add_argument('--num_threads', action="store", dest="num_threads", type=int, help="Number of threads to execute")
+    parser.add_argument('--http_retries', action="store", dest="http_retries", type=int, default=5, help="Number of retries for failed HTTP calls")
+    parser.add_argument('--http_backoff_factor', action="store", dest="http_backoff_factor", type=float, default=1.0, help="Backoff factor (seconds) between HTTP retries")
     parser.add_argument('--token_mailgun', action="store", dest="token_mailgun", type=str, help="Mailgun API key")
     parser.add_argument('--google_wpid', action="store", dest="google_wpid", type=str, help="Google Analytics WP id")
     parser.add_argument('--google_project_id', action="store", dest="google_project_id", type=str, help="Google Analytics Project ID")
@@ -62,6 +109,9 @@ if __name__ == "__main__":
     parser.add_argument('--google_client_email', action="store", dest="google_client_email", type=str, help="Google Analytics Client Email")
     parser.add_argument('--google_client_id', action="store", dest="google_client_id", type=str, help="Google Analytics Client ID")
     parser.add_argument('--google_client_x509_cert_url', action="store", dest="google_client_x509_cert_url", type=str, help="Google Analytics Client X509 Cert Url")
+    parser.add_argument('--no-ga-cache', action="store_false", dest="ga_cache", help="Don't use the on-disk cache of the Google Analytics daily results")
+    parser.add_argument('--ga-per-day', action="store_false", dest="ga_range", help="Query Google Analytics one day at a time instead of whole months")
+    parser.add_argument('--ga_settle_days', action="store", dest="ga_settle_days", type=int, default=3, help="Recent days whose Google Analytics results are always fetched again")
 
     args = parser.parse_args()
 
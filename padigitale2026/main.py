@@ -4,47 +4,48 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-import ast
-import csv
 import argparse
-from datetime import datetime
-from common import MongoAction
+from common import MongoAction, CsvLoader
 
 
 class PaDigitale:
-    def guess_types(self, row):
-        attempt_fns = [ast.literal_eval,
-            int,
-            float,
-            lambda x: datetime.strptime(x, "%Y-%m-%dT%H:%M:%SZ")]
+    def main(self, args):
+        mongoAction = MongoAction(args.mongodb_user, args.mongodb_pass, args.mongodb_db, args.mongodb_host, args.mongodb_authdb)
+        mongoAction.createClient()
 
-        for fieldname in row:
-            for fn in attempt_fns:
-                try:
-                    row[fieldname] = fn(row[fieldname])
-                    break
-                except (ValueError, SyntaxError):
-                    pass
-        return row
+        # When both engine.csv and engine.csv.gz exist the newer one is loaded
+        files = {}
+        for file in sorted(os.listdir(args.data_dir)):
+            if file.endswith(".csv") or file.endswith(".csv.gz"):
+                engine = file.replace('.gz', '').replace('.csv', '').lower()
+                collection = 'padigitale_{}'.format(engine)
+                if collection in files:
+                    older, file = sorted([files[collection], file],
+                        key=lambda f: os.path.getmtime(os.path.join(args.data_dir, f)))
+                    print("Skipping file {}, {} is loaded from the newer {}".format(older, collection, file))
 
-    def main(self, args):
-        for file in os.listdir(args.data_dir):
-            if file.endswith(".csv"):
-                print("Processing file {}...".format(file))
-                engine = file.replace('.csv', '').lower()
+                files[collection] = file
 
+        # Each file goes live on its own, a failed one doesn't block the others
+        with mongoAction.stagedPublish(workers=args.workers, atomic=False) as publish:
+            for collection, file in files.items():
+                print("Processing file {}...".format(file))
                 filename = os.path.join(args.data_dir, file)
-                with open(filename, "r") as csvfile:
-                    mongoAction = MongoAction(args.mongodb_user, args.mongodb_pass, args.mongodb_db, args.mongodb_host, args.mongodb_authdb)
-                    mongoAction.createClient()
+                publish.load(collection, CsvLoader(filename))
+
+        mongoAction.closeClient()
 
-                    datareader = csv.DictReader(csvfile, delimiter=',', quotechar='"')
-                    for row in datareader:
-                        row = self.guess_types(row)
-                        mongoAction.saveObject('padigitale_{}_new'.format(engine), row)
+        failed = False
+        for collection, file in files.items():
+            result = publish.results[collection]
+            if isinstance(result, Exception):
+                failed = True
+                print("{}: FAILED ({})".format(file, result))
+            else:
+                print("{}: {} rows loaded into {}".format(file, result, collection))
 
-                    mongoAction.renameCollection('padigitale_{}_new'.format(engine), 'padigitale_{}'.format(engine))
-                    mongoAction.closeClient()
+        if failed:
+            sys.exit(1)
 
 def GetParseOptions():
     parser = argparse.ArgumentParser(description="Program to manage files from Developers Italia")
@@ -60,6 +61,8 @@ def GetParseOptions():
                         dest="mongodb_db", type=str, default=None, help="Mongodb DB")
     parser.add_argument('--mongodb-authdb', action="store",
                         dest="mongodb_authdb", type=str, default='admin', help="Mongodb Auth DB")
+    parser.add_argument('--workers', action="store", dest="workers", type=int,
+                        default=4, help="Number of files to load concurrently")
     args = parser.parse_args()
 
     return args
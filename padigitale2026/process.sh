@@ -4,6 +4,7 @@ set -e
 
 SCRIPTDIR=${SCRIPTDIR:-/opt/ingestion_scripts}
 PADIGITALE_DATADIR=${PADIGITALE_DATADIR:-SCRIPTDIR/padigitale/data}
+PADIGITALE_WORKERS=${PADIGITALE_WORKERS:-4}
 MONGODB_HOSTNAME=${MONGODB_HOSTNAME:-unset}
 MONGODB_DATABASE=${MONGODB_DATABASE:-unset}
 MONGODB_USERNAME=${MONGODB_USERNAME:-unset}
@@ -36,4 +37,5 @@ python3 ${SCRIPTDIR}/padigitale2026/main.py \
     --mongodb-db "${MONGODB_DATABASE}" \
     --mongodb-user "${MONGODB_USERNAME}" \
     --mongodb-pass "${MONGODB_PASSWORD}" \
-    --mongodb-authdb "${MONGODB_AUTHDB}"
+    --mongodb-authdb "${MONGODB_AUTHDB}" \
+    --workers "${PADIGITALE_WORKERS}"
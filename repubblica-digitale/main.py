@@ -8,7 +8,7 @@ import pandas as pd
 import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from common import MongoAction
+from common import MongoAction, dataFrameToDocuments, seriesToDocument
 
 class RepubblicaDigitale:
     args = None
@@ -20,7 +20,12 @@ class RepubblicaDigitale:
         if getattr(self.args, property_name, None):
             return getattr(self.args, property_name)
 
-    def save_to_mongo(self, args, collection, collection_temp, data, method):
+    def to_documents(self, data, method):
+        if method:
+            return dataFrameToDocuments(data)
+        return [seriesToDocument(data)]
+
+    def save_to_mongo(self, args, collection, data, method):
         mongoAction = MongoAction(
             self.get_property('mongodb_user'),
             self.get_property('mongodb_pass'),
@@ -30,14 +35,8 @@ class RepubblicaDigitale:
 
         mongoAction.createClient()
 
-        if method:
-            data_json = [row.to_dict() for idx, row in data.iterrows()]
-            mongoAction.insertManyCollection(collection_temp, data_json)
-        else:
-            data_json = data.to_dict()
-            mongoAction.insertCollection(collection_temp, data_json)
-
-        mongoAction.renameCollection(collection_temp, collection)
+        with mongoAction.stagedPublish() as publish:
+            publish.load(collection, self.to_documents(data, method))
 
         mongoAction.closeClient()
 
@@ -78,7 +77,7 @@ class RepubblicaDigitale:
             if len(values) > 0 and row[2].isdigit():
                 repubblica_digitale_overall.append({'categoria': row[0], 'tipologia': row[1], 'quantita': int(row[2])})
 
-        self.save_to_mongo(args, "repubblica_digitale_overall", "repubblica_digitale_overall_tmp", pd.DataFrame(repubblica_digitale_overall), True)
+        self.save_to_mongo(args, "repubblica_digitale_overall", pd.DataFrame(repubblica_digitale_overall), True)
 
 def GetParseOptions():
     parser = argparse.ArgumentParser(description="Data ingestion for Repubblica Digitale")
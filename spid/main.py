@@ -20,6 +20,8 @@ MODALITA_RILASCIO_TRANS = dict(
 
 class Spid:
     params = None
+    mongoAction = None
+    publish = None
 
     def manageSpid(self, filePath, tableName):
         data = pandas.read_csv(filePath, sep='\t')
@@ -27,13 +29,6 @@ class Spid:
         objs = data.transpose().to_dict().values()
         providers = []
 
-        mongoAction = MongoAction(self.params.mongodb_user,
-                                    self.params.mongodb_pass,
-                                    self.params.mongodb_db,
-                                    self.params.mongodb_host,
-                                    self.params.mongodb_authdb)
-        mongoAction.createClient()
-
         for obj in objs:
             week = obj['week']  # .astype(int)
             year = obj['year']  # .astype(int)
@@ -53,10 +48,7 @@ class Spid:
                     provider['data'] = obj['data']
                     providers.append(provider)
 
-        for prov in providers:
-            mongoAction.insertCollection(tableName + '_tmp', prov)
-        mongoAction.renameCollection(tableName + '_tmp', tableName)
-        mongoAction.closeClient()
+        self.publish.load(tableName, providers)
         
         if tableName == 'spid_overall_final':
             #tot_2017 = data.loc[(data['year'] == 2017) & (data['week'] <= 18), 'total'].sum()
@@ -64,15 +56,7 @@ class Spid:
             tot_2016 = data.loc[data['year'] == 2016, 'total'].sum()
             crescita = int(((float(total) - float(tot_2016)) / tot_2016) * 100)
 
-            mongoAction = MongoAction(self.params.mongodb_user,
-                                        self.params.mongodb_pass,
-                                        self.params.mongodb_db,
-                                        self.params.mongodb_host,
-                                        self.params.mongodb_authdb)
-            mongoAction.createClient()
-            
-            mongoAction.dropAndInsertCollection('spid_crescita', {'crescita': crescita})
-            mongoAction.closeClient()
+            self.publish.load('spid_crescita', [{'crescita': crescita}])
 
         return total
 
@@ -80,13 +64,7 @@ class Spid:
         data = pandas.read_csv(filePath, sep='\t')
         objs = data.transpose().to_dict().values()
 
-        mongoAction = MongoAction(self.params.mongodb_user,
-                                    self.params.mongodb_pass,
-                                    self.params.mongodb_db,
-                                    self.params.mongodb_host,
-                                    self.params.mongodb_authdb)
-        mongoAction.createClient()
-        
+        details = []
         for obj in objs:
             week_year = obj['NUM_SETTIMANA'].split('_')
             week = week_year[1]
@@ -102,24 +80,17 @@ class Spid:
             obj['SESSO_DESC'] = sesso
             mod_rilascio = MODALITA_RILASCIO_TRANS[obj['MODALITA_RILASCIO']]
             obj['MODALITA_RILASCIO_DESC'] = mod_rilascio
-            mongoAction.insertCollection('spid_details_tmp', obj)
+            details.append(obj)
 
-        mongoAction.renameCollection('spid_details_tmp', 'spid_details')
-        mongoAction.closeClient()
+        self.publish.load('spid_details', details, ['data'])
 
     def normalizeModalita(self, filePath, total):
         data = pandas.read_csv(filePath, sep='\t')
         total_prev = data['ID_RILASCIATE'].sum()
         test = data.groupby(['MODALITA_RILASCIO'])['ID_RILASCIATE'].sum()
 
-        mongoAction = MongoAction(self.params.mongodb_user,
-                                    self.params.mongodb_pass,
-                                    self.params.mongodb_db,
-                                    self.params.mongodb_host,
-                                    self.params.mongodb_authdb)
-        mongoAction.createClient()
-
         total_diff = 0
+        finals = []
         for n, index in enumerate(test.index):
             if n != len(test.index) - 1:
                 mod_rilascio = MODALITA_RILASCIO_TRANS[index]
@@ -127,7 +98,7 @@ class Spid:
                 diff = (perc * total) / total_prev
                 total_diff = total_diff + diff
                 final = {'Modalita_rilascio': mod_rilascio, 'totale': diff}
-                mongoAction.insertCollection('MODALITA_RILASCIO_tmp', final)
+                finals.append(final)
             else:
                 mod_rilascio = MODALITA_RILASCIO_TRANS[index]
                 perc = test[index]
@@ -137,24 +108,17 @@ class Spid:
                 if (total - total_diff) > 0:
                     offset = total - total_diff
                 final = {'Modalita_rilascio': mod_rilascio, 'totale': diff + offset}
-                mongoAction.insertCollection('MODALITA_RILASCIO_tmp', final)
+                finals.append(final)
                 
-        mongoAction.renameCollection('MODALITA_RILASCIO_tmp', 'MODALITA_RILASCIO')
-        mongoAction.closeClient()
+        self.publish.load('MODALITA_RILASCIO', finals)
 
     def normalizeEta(self, filePath, total):
         data = pandas.read_csv(filePath, sep='\t')
         total_prev = data['ID_RILASCIATE'].sum()
         test = data.groupby(['FASCIA_ETA'])['ID_RILASCIATE'].sum()
 
-        mongoAction = MongoAction(self.params.mongodb_user,
-                                    self.params.mongodb_pass,
-                                    self.params.mongodb_db,
-                                    self.params.mongodb_host,
-                                    self.params.mongodb_authdb)
-        mongoAction.createClient()
-        
         total_diff = 0
+        finals = []
         for n, index in enumerate(test.index):
             if n != len(test.index) - 1:
                 fascia_eta = FASCIA_ETA_TRANS[index]
@@ -162,7 +126,7 @@ class Spid:
                 diff = (perc * total) / total_prev
                 total_diff = total_diff + diff
                 final = {'Fascia_eta': fascia_eta, 'totale': diff}
-                mongoAction.insertCollection('FASCIA_ETA_tmp', final)
+                finals.append(final)
             else:
                 fascia_eta = FASCIA_ETA_TRANS[index]
                 perc = test[index]
@@ -172,24 +136,17 @@ class Spid:
                 if (total - total_diff) > 0:
                     offset = total - total_diff
                 final = {'Fascia_eta': fascia_eta, 'totale': diff + offset}
-                mongoAction.insertCollection('FASCIA_ETA_tmp', final)
+                finals.append(final)
 
-        mongoAction.renameCollection('FASCIA_ETA_tmp', 'FASCIA_ETA')
-        mongoAction.closeClient()
+        self.publish.load('FASCIA_ETA', finals)
 
     def normalizeSesso(self, filePath, total):
         data = pandas.read_csv(filePath, sep='\t')
         total_prev = data['ID_RILASCIATE'].sum()
         test = data.groupby(['SESSO'])['ID_RILASCIATE'].sum()
 
-        mongoAction = MongoAction(self.params.mongodb_user,
-                                    self.params.mongodb_pass,
-                                    self.params.mongodb_db,
-                                    self.params.mongodb_host,
-                                    self.params.mongodb_authdb)
-        mongoAction.createClient()
-        
         total_diff = 0
+        finals = []
         for n, index in enumerate(test.index):
             if n != len(test.index) - 1:
                 sesso = SESSO_TRANS[index]
@@ -197,7 +154,7 @@ class Spid:
                 diff = (perc * total) / total_prev
                 total_diff = total_diff + diff
                 final = {'sesso': sesso, 'totale': diff}
-                mongoAction.insertCollection('SESSO_tmp', final)
+                finals.append(final)
             else:
                 sesso = SESSO_TRANS[index]
                 perc = test[index]
@@ -207,10 +164,9 @@ class Spid:
                 if (total - total_diff) > 0:
                     offset = total - total_diff
                 final = {'sesso': sesso, 'totale': diff + offset}
-                mongoAction.insertCollection('SESSO_tmp', final)
+                finals.append(final)
         
-        mongoAction.renameCollection('SESSO_tmp', 'SESSO')
-        mongoAction.closeClient()
+        self.publish.load('SESSO', finals)
 
     def getParseOptions(self):
         parser = argparse.ArgumentParser(description="SPID processor")
@@ -234,12 +190,24 @@ class Spid:
         self.params = self.getParseOptions()
         data_path_dest = self.params.data_path_dest
 
-        total = self.manageSpid(f"{data_path_dest}/overall.csv", 'spid_overall_final')
-        self.manageSpid(f"{data_path_dest}/eighteen.csv", 'spid_eighteen')
-        self.manageDetails(f"{data_path_dest}/details.csv")
-        self.normalizeEta(f"{data_path_dest}/details.csv", total)
-        self.normalizeModalita(f"{data_path_dest}/details.csv", total)
-        self.normalizeSesso(f"{data_path_dest}/details.csv", total)
+        self.mongoAction = MongoAction(self.params.mongodb_user,
+                                        self.params.mongodb_pass,
+                                        self.params.mongodb_db,
+                                        self.params.mongodb_host,
+                                        self.params.mongodb_authdb)
+        self.mongoAction.createClient()
+
+        # Collections are loaded concurrently and go live together at the end
+        self.publish = self.mongoAction.stagedPublish()
+        with self.publish:
+            total = self.manageSpid(f"{data_path_dest}/overall.csv", 'spid_overall_final')
+            self.manageSpid(f"{data_path_dest}/eighteen.csv", 'spid_eighteen')
+            self.manageDetails(f"{data_path_dest}/details.csv")
+            self.normalizeEta(f"{data_path_dest}/details.csv", total)
+            self.normalizeModalita(f"{data_path_dest}/details.csv", total)
+            self.normalizeSesso(f"{data_path_dest}/details.csv", total)
+
+        self.mongoAction.closeClient()
 
 
 if __name__ == '__main__':